@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join('v7', 'wordpress_compiler', 'wordpress'))
+
+from image_probe import probe_image_size
+from nikola.utils import LOGGER
+
+
+def png(width, height):
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+
+
+def gif(width, height):
+    return b'GIF89a' + struct.pack('<HHBBB', width, height, 0, 0, 0) + b'\x3b'
+
+
+def jpeg(width, height, sof=0xC0):
+    data = b'\xff\xd8'
+    # APP0 (JFIF) and DQT segments come before the frame header
+    data += b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    data += b'\xff\xdb' + struct.pack('>H', 67) + b'\x00' + b'\x01' * 64
+    # Fill bytes are allowed before any marker
+    data += b'\xff\xff'
+    data += struct.pack('>BBHBHHB', 0xFF, sof, 11, 8, height, width, 1) + b'\x01\x11\x00'
+    data += b'\xff\xd9'
+    return data
+
+
+def webp(chunk, payload):
+    body = b'WEBP' + chunk + struct.pack('<I', len(payload)) + payload
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+def webp_lossy(width, height):
+    return webp(b'VP8 ', b'\x30\x01\x00' + b'\x9d\x01\x2a' + struct.pack('<HH', width, height) + b'\x00' * 8)
+
+
+def webp_lossless(width, height):
+    bits = (width - 1) | ((height - 1) << 14)
+    return webp(b'VP8L', b'\x2f' + struct.pack('<I', bits) + b'\x00' * 8)
+
+
+def webp_extended(width, height):
+    return webp(b'VP8X', b'\x10\x00\x00\x00' + struct.pack('<I', width - 1)[:3] + struct.pack('<I', height - 1)[:3])
+
+
+class TestProbeImageSize(unittest.TestCase):
+    @staticmethod
+    def setUpClass():
+        LOGGER.notice('--- TESTS FOR image_probe')
+
+    @staticmethod
+    def tearDownClass():
+        sys.stdout.write('\n')
+        LOGGER.notice('--- END OF TESTS FOR image_probe')
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def probe(self, data):
+        filename = os.path.join(self.tmpdir, 'image')
+        with io.open(filename, 'wb') as f:
+            f.write(data)
+        return probe_image_size(filename)
+
+    def test_png(self):
+        self.assertEqual(self.probe(png(640, 480)), (640, 480))
+
+    def test_gif(self):
+        self.assertEqual(self.probe(gif(320, 200)), (320, 200))
+
+    def test_jpeg_baseline(self):
+        self.assertEqual(self.probe(jpeg(1024, 768)), (1024, 768))
+
+    def test_jpeg_progressive(self):
+        self.assertEqual(self.probe(jpeg(800, 600, sof=0xC2)), (800, 600))
+
+    def test_webp_lossy(self):
+        self.assertEqual(self.probe(webp_lossy(400, 300)), (400, 300))
+
+    def test_webp_lossless(self):
+        self.assertEqual(self.probe(webp_lossless(16383, 1)), (16383, 1))
+
+    def test_webp_extended(self):
+        self.assertEqual(self.probe(webp_extended(20000, 10000)), (20000, 10000))
+
+    def test_truncated(self):
+        self.assertIsNone(self.probe(png(640, 480)[:9]))
+        # Cut off in the middle of the DQT segment, before the frame header
+        self.assertIsNone(self.probe(jpeg(1024, 768)[:40]))
+        self.assertIsNone(self.probe(b''))
+
+    def test_unknown(self):
+        self.assertIsNone(self.probe(b'BM' + b'\x00' * 40))
+
+
+if __name__ == '__main__':
+    unittest.main()
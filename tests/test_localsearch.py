@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join('v7', 'localsearch'))
+
+from localsearch import _truncate
+from localsearch.inverted_index import IndexBuilder, Tokenizer
+from localsearch.query import SearchIndex
+from nikola.utils import LOGGER
+
+
+def setUpModule():
+    LOGGER.notice('--- TESTS FOR localsearch')
+
+
+def tearDownModule():
+    sys.stdout.write('\n')
+    LOGGER.notice('--- END OF TESTS FOR localsearch')
+
+
+class TestTruncate(unittest.TestCase):
+    def test_no_limit(self):
+        self.assertEqual(_truncate('hello world', None), 'hello world')
+        self.assertEqual(_truncate('hello world', 0), 'hello world')
+
+    def test_short_enough(self):
+        self.assertEqual(_truncate('hello world', 11), 'hello world')
+
+    def test_cut_in_word(self):
+        self.assertEqual(_truncate('hello world foo', 8), 'hello')
+
+    def test_cut_at_boundary(self):
+        self.assertEqual(_truncate('hello world foo', 11), 'hello world')
+        self.assertEqual(_truncate('hello world foo', 12), 'hello world')
+
+    def test_single_long_word(self):
+        self.assertEqual(_truncate('abcdefghij', 4), 'abcd')
+
+    def test_leading_whitespace(self):
+        self.assertEqual(_truncate('   \n   hello', 3), '')
+        self.assertEqual(_truncate('   hello', 4), '')
+
+
+RECORDS = [
+    {"title": "Python packaging", "text": "How to package a library.", "tags": "python", "loc": "/packaging/"},
+    {"title": "Static sites", "text": "Nikola builds static sites with python.", "tags": "nikola", "loc": "/static/"},
+    {"title": "Cooking", "text": "Pasta, pasta and more pasta.", "tags": "", "loc": "/cooking/"},
+]
+
+
+class FakeStemmer(object):
+    def stemWord(self, word):
+        return word[:-1] if word.endswith('s') else word
+
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.tokenizer = Tokenizer()
+        self.tokenizer.stemmer = FakeStemmer()
+        self.index = SearchIndex.from_records(RECORDS, self.tokenizer)
+
+    def locs(self, query):
+        return [page[1] for page, count, weight in self.index.search(query)]
+
+    def test_postings(self):
+        builder = IndexBuilder(Tokenizer(), {"title": 10, "tags": 5, "text": 1})
+        self.assertEqual(builder.add(RECORDS[2]), 4)
+        builder.add(RECORDS[0])
+        members = dict((name, items) for name, kind, items in builder.json_members())
+        # Counted per field, weighted by the field boost and summed
+        self.assertEqual(dict(members["terms"])["pasta"], [0, 3])
+        self.assertEqual(dict(members["terms"])["python"], [1, 15])
+        self.assertEqual(members["pages"][0], ["Cooking", "/cooking/", "", "Pasta, pasta and more pasta."])
+
+    def test_field_boosts(self):
+        # A match in the title outweighs one in the text
+        self.assertEqual(self.locs("python"), ["/packaging/", "/static/"])
+
+    def test_more_words_first(self):
+        self.assertEqual(self.locs("static python"), ["/static/", "/packaging/"])
+
+    def test_stems(self):
+        self.assertEqual(self.index.stems["sites"], "site")
+        self.assertEqual(self.locs("sites"), ["/static/"])
+
+    def test_prefix(self):
+        self.assertEqual(self.locs("pack"), ["/packaging/"])
+        self.assertEqual(self.locs("nothing"), [])
+
+    def test_unknown_words_are_not_stemmed(self):
+        # The client only knows the stems of indexed words
+        self.assertEqual(self.index.lookup("packages"), [])
+        self.assertEqual(self.index.lookup("package"), ["package"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join('v7', 'planetoid'))
+
+import planetoid
+from nikola.utils import LOGGER
+
+
+def setUpModule():
+    LOGGER.notice('--- TESTS FOR planetoid')
+
+
+def tearDownModule():
+    sys.stdout.write('\n')
+    LOGGER.notice('--- END OF TESTS FOR planetoid')
+
+
+def rss(items):
+    return ('<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel><title>A feed</title>'
+            '{0}</channel></rss>'.format(''.join(items))).encode('utf-8')
+
+
+def result(content):
+    return {'url': 'http://example.com/feed.xml', 'status': 200, 'content': content, 'error': None,
+            'headers': {'content-location': 'http://example.com/feed.xml'}}
+
+
+@unittest.skipIf(planetoid.feedparser is None, 'feedparser is not installed')
+class TestParseFeed(unittest.TestCase):
+    def test_entries(self):
+        data = planetoid.parse_feed('Feed', result(rss([
+            '<item><title>One</title><link>http://example.com/1</link><guid>guid-1</guid>'
+            '<pubDate>Mon, 01 Jan 2024 12:00:00 GMT</pubDate><description>First</description></item>',
+            '<item><title>Two</title><link>http://example.com/2</link><guid>guid-2</guid>'
+            '<pubDate>Wed, 03 Jan 2024 12:00:00 GMT</pubDate><description>Second</description></item>',
+            '<item><title>Undated</title><link>http://example.com/3</link></item>',
+        ])))
+        self.assertEqual(data['title'], 'A feed')
+        self.assertEqual(data['undated'], 1)
+        self.assertEqual([row['title'] for row in data['rows']], ['Feed: One', 'Feed: Two'])
+        self.assertEqual(data['rows'][0]['link'], 'http://example.com/1')
+        self.assertEqual(data['newest'], datetime.datetime(2024, 1, 3, 12, 0))
+        self.assertEqual(data['update_interval'], 2 * 24 * 60)
+
+    def test_entry_without_link(self):
+        data = planetoid.parse_feed('Feed', result(rss([
+            '<item><title>One</title><guid isPermaLink="false">guid-1</guid>'
+            '<pubDate>Mon, 01 Jan 2024 12:00:00 GMT</pubDate><description>First</description></item>',
+        ])))
+        self.assertEqual(data['rows'][0]['guid'], 'guid-1')
+        self.assertEqual(data['rows'][0]['link'], '')
+
+
+@unittest.skipIf(planetoid.requests is None, 'requests is not installed')
+class TestFetchFeeds(unittest.TestCase):
+    def test_unexpected_error(self):
+        # Not a datetime, so building the conditional request fails
+        results = planetoid.fetch_feeds([('http://127.0.0.1:9/feed.xml', None, 'yesterday')])
+        self.assertIn('AttributeError', results[0]['error'])
+        self.assertIn('elapsed', results[0])
+
+    def test_callback_error(self):
+        def callback(i, result):
+            raise ValueError('broken')
+
+        results = planetoid.fetch_feeds([('http://127.0.0.1:9/feed.xml', None, None)], callback=callback)
+        self.assertIn('broken', results[0]['error'])
+        self.assertIn('elapsed', results[0])
+
+
+class TestEntryFingerprint(unittest.TestCase):
+    def test_copies(self):
+        self.assertEqual(planetoid.entry_fingerprint('Hello, World', '<p>Some <b>text</b>.</p>'),
+                         planetoid.entry_fingerprint('hello world', 'Some text'))
+
+    def test_different(self):
+        self.assertNotEqual(planetoid.entry_fingerprint('Hello', 'Some text'),
+                            planetoid.entry_fingerprint('Hello', 'Other text'))
+        self.assertNotEqual(planetoid.entry_fingerprint('Hello', 'Some text'),
+                            planetoid.entry_fingerprint('Goodbye', 'Some text'))
+
+    def test_placeholders(self):
+        # Untitled link posts are not copies of each other
+        self.assertEqual(planetoid.entry_fingerprint('Untitled', '<a href="http://example.com/1">link</a>'), '')
+        self.assertEqual(planetoid.entry_fingerprint('Sin título', 'Sin contenido'), '')
+        self.assertEqual(planetoid.entry_fingerprint('Untitled', 'Some longer text'),
+                         planetoid.entry_fingerprint('', 'some longer text'))
+
+
+class TestRefreshInterval(unittest.TestCase):
+    def interval(self, update_interval, quiet_for, failures=0):
+        return planetoid.refresh_interval(update_interval, quiet_for, failures, 60, 15, 24 * 60)
+
+    def test_unknown(self):
+        self.assertEqual(self.interval(None, None), 60)
+
+    def test_active_feed(self):
+        self.assertEqual(self.interval(120, 10), 60)
+
+    def test_quiet_feed(self):
+        self.assertEqual(self.interval(120, 600), 300)
+
+    def test_limits(self):
+        self.assertEqual(self.interval(2, 1), 15)
+        self.assertEqual(self.interval(None, 100000), 24 * 60)
+
+    def test_failures(self):
+        self.assertEqual(self.interval(120, 10, 1), 30)
+        self.assertEqual(self.interval(120, 10, 3), 120)
+        self.assertEqual(self.interval(120, 10, 20), 24 * 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -26,13 +26,27 @@
 
 from __future__ import unicode_literals
 import codecs
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
 import json
+import multiprocessing
 import os
+import re
 
-from doit.tools import result_dep
+try:
+    import brotli
+except ImportError:
+    brotli = None  # NOQA
 
 from nikola.plugin_categories import LateTask
-from nikola.utils import config_changed, copy_tree, makedirs
+from nikola.utils import config_changed, copy_tree, get_logger, makedirs, req_missing, STDERR_HANDLER
+
+from . import inverted_index, query
+
+LOGGER = get_logger('local_search', STDERR_HANDLER)
 
 # This is what we need to produce:
 # var tipuesearch = {"pages": [
@@ -50,6 +64,232 @@ from nikola.utils import config_changed, copy_tree, makedirs
 # ]};
 
 
+def _stat_deps(paths):
+    """Return (path, mtime, size) for each path, with None for missing files."""
+    result = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            result.append([path, st.st_mtime, st.st_size])
+        except OSError:
+            result.append([path, None, None])
+    return result
+
+
+def _fragment_path(post, lang):
+    """Return the compiled fragment which post.text() reads for a language."""
+    for candidate in [lang, post.default_lang] + sorted(post.translated_to):
+        if candidate in post.translated_to:
+            return post.translated_base_path(candidate)
+    return post.base_path
+
+
+def _is_indexed(post, lang, untranslated):
+    # Don't index drafts (Issue #387)
+    if post.is_draft or post.is_private or post.publish_later:
+        return False
+    # Untranslated posts would only be indexed again with the fallback text
+    return untranslated or post.is_translation_available(lang)
+
+
+def _post_fingerprint(post, lang):
+    """Return everything about a post in a language which affects the index.
+
+    Changes of the text itself are caught by depending on the compiled
+    fragment (see _fragment_path).
+    """
+    return {
+        "source": post.source_path,
+        "lang": lang,
+        "title": post.title(lang),
+        "tags": post.tags,
+        "loc": post.permalink(lang),
+        "draft": post.is_draft,
+        "private": post.is_private,
+        "publish_later": post.publish_later,
+        "translated": post.is_translation_available(lang),
+    }
+
+
+def _shard_key(post, lang):
+    """Return a key identifying the index record of a post in a language.
+
+    The key changes whenever the post's fragment dependencies, its compiled
+    fragment or its indexed metadata change.
+    """
+    data = _post_fingerprint(post, lang)
+    data["deps"] = _stat_deps(post.fragment_deps(lang) + [_fragment_path(post, lang)])
+    return hashlib.md5(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _extract_record(post, lang):
+    """Extract the index record of a post in a language."""
+    text = post.text(lang, strip_html=True)
+    text = text.replace('^', '')
+
+    data = {}
+    data["title"] = post.title(lang)
+    data["text"] = text
+    data["tags"] = ",".join(post.tags)
+    data["loc"] = post.permalink(lang)
+    return data
+
+
+# The (post, lang) pairs being extracted by a worker pool.  Workers are
+# forked, so they inherit this list and only get passed indices into it:
+# posts can't be pickled.
+_EXTRACT_JOBS = []
+
+
+def _extract_job(index):
+    post, lang = _EXTRACT_JOBS[index]
+    return _extract_record(post, lang)
+
+
+def _extract_records(jobs, workers):
+    """Extract the records of the (post, lang) pairs in jobs, in order.
+
+    Uses a pool of forked worker processes if workers > 1 and the platform
+    supports it, and extracts serially otherwise.
+    """
+    global _EXTRACT_JOBS
+    if workers > 1 and len(jobs) > 1 and hasattr(os, "fork"):
+        _EXTRACT_JOBS = jobs
+        try:
+            try:
+                pool = multiprocessing.get_context("fork").Pool(workers)
+            except AttributeError:  # Python 2 always forks
+                pool = multiprocessing.Pool(workers)
+        except (AssertionError, OSError):  # e.g. when running in a daemonic process
+            pool = None
+        if pool is not None:
+            try:
+                chunksize = max(1, min(64, len(jobs) // (workers * 4)))
+                for record in pool.imap(_extract_job, range(len(jobs)), chunksize):
+                    yield record
+            finally:
+                pool.close()
+                pool.join()
+                _EXTRACT_JOBS = []
+            return
+    for post, lang in jobs:
+        yield _extract_record(post, lang)
+
+
+def _read_shard(path):
+    with io.open(path, "rb") as fd:
+        return json.loads(fd.read().decode('utf-8'))
+
+
+def _write_shard(path, data):
+    # Write to a temporary file first, so an interrupted build never
+    # leaves a truncated shard under a valid key.
+    tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+    with io.open(tmp_path, "wb") as fd:
+        fd.write(json.dumps(data).encode('utf-8'))
+    os.rename(tmp_path, path)
+
+
+def _dumps(data):
+    return json.dumps(data, separators=(',', ':'))
+
+
+def _truncate(text, length):
+    """Cut text down to at most length characters, preferably at a word boundary."""
+    if not length or len(text) <= length:
+        return text
+    if text[length].isspace() or text[length - 1].isspace():
+        # The cut is at a word boundary already
+        return text[:length].rstrip()
+    parts = text[:length].rsplit(None, 1)
+    if len(parts) == 2:
+        return parts[0]
+    if text[0].isspace():
+        # Only whitespace before the (cut) first word
+        return ''
+    # A single word longer than length, so there is no boundary to cut at
+    return text[:length]
+
+
+def _check_size_budget(paths, budget, contributors, unit):
+    """Warn if the files in paths are larger than budget bytes together.
+
+    contributors is a list of (size, loc) pairs, the largest of which are
+    reported along with the warning.
+    """
+    total = sum(os.path.getsize(path) for path in paths)
+    if not budget or total <= budget:
+        return
+    LOGGER.warning("{0} is {1} KiB, more than LOCAL_SEARCH_SIZE_BUDGET ({2} KiB). Largest contributors:".format(
+        os.path.basename(paths[0]), total // 1024, budget // 1024))
+    for size, loc in heapq.nlargest(10, contributors):
+        LOGGER.warning("    {0:>8} {1}  {2}".format(size, unit, loc))
+
+
+def _write_json_stream(path, members, sizes=None):
+    """Write a JSON object to path without building it in memory first.
+
+    members is a list of (name, kind, items): if kind is "list", items are
+    the values of a list, if it is "dict", items are (key, value) pairs.
+    Items are consumed and written one at a time.  If sizes is a list, the
+    serialized length of each list item is appended to it.
+    """
+    makedirs(os.path.dirname(path))
+    with codecs.open(path, "wb+", "utf8") as fd:
+        fd.write("{")
+        for i, (name, kind, items) in enumerate(members):
+            if i:
+                fd.write(",")
+            fd.write(_dumps(name) + (":[" if kind == "list" else ":{"))
+            for j, item in enumerate(items):
+                if j:
+                    fd.write(",")
+                if kind == "list":
+                    data = _dumps(item)
+                    fd.write(data)
+                    if sizes is not None:
+                        sizes.append(len(data))
+                else:
+                    fd.write(_dumps(item[0]) + ":" + _dumps(item[1]))
+            fd.write("]" if kind == "list" else "}")
+        fd.write("}")
+
+
+def _precompress(path, formats):
+    """Write .gz and/or .br siblings of a file, for servers which serve them directly."""
+    for fmt in formats:
+        if fmt == "gz":
+            with io.open(path, "rb") as src:
+                with gzip.GzipFile(path + ".gz", "wb", 9, mtime=0) as dst:
+                    for chunk in iter(lambda: src.read(65536), b""):
+                        dst.write(chunk)
+        elif fmt == "br":
+            compressor = brotli.Compressor(quality=11)
+            with io.open(path, "rb") as src:
+                with io.open(path + ".br", "wb") as dst:
+                    for chunk in iter(lambda: src.read(65536), b""):
+                        dst.write(compressor.process(chunk))
+                    dst.write(compressor.finish())
+        else:
+            raise ValueError("Unknown LOCAL_SEARCH_PRECOMPRESS format '{0}'".format(fmt))
+
+
+def _remove_stale_shards(dst_paths, keep):
+    """Delete the shards (and their precompressed siblings) which are not in keep.
+
+    They are left over from a build which had more shards, e.g. before
+    posts were deleted.  The shards are the files named like dst_paths[0],
+    with another number.
+    """
+    folder, name = os.path.split(dst_paths[0])
+    pattern = re.compile(re.escape(name.rsplit(".", 2)[0]) + r"\.\d+\.json(\.\w+)?$")
+    keep = set(keep)
+    for filename in os.listdir(folder):
+        path = os.path.join(folder, filename)
+        if pattern.match(filename) and path not in keep:
+            os.unlink(path)
+
+
 class Tipue(LateTask):
     """Render the blog posts as JSON data."""
 
@@ -61,46 +301,202 @@ class Tipue(LateTask):
         kw = {
             "translations": self.site.config['TRANSLATIONS'],
             "output_folder": self.site.config['OUTPUT_FOLDER'],
+            "split": self.site.config.get('LOCAL_SEARCH_SPLIT', False),
+            "shard_size": self.site.config.get('LOCAL_SEARCH_SHARD_SIZE', 1000),
+            "precompress": self.site.config.get('LOCAL_SEARCH_PRECOMPRESS', []),
+            "untranslated": self.site.config.get('LOCAL_SEARCH_INDEX_UNTRANSLATED', False),
+            "text_length": self.site.config.get('LOCAL_SEARCH_TEXT_LENGTH', None),
+            "size_budget": self.site.config.get('LOCAL_SEARCH_SIZE_BUDGET', None),
+            "inverted_index": self.site.config.get('LOCAL_SEARCH_INVERTED_INDEX', False),
+            "tokenizer": self.site.config.get('LOCAL_SEARCH_TOKENIZER', {}),
+            "field_boosts": self.site.config.get('LOCAL_SEARCH_FIELD_BOOSTS', inverted_index.DEFAULT_FIELD_BOOSTS),
         }
+        if "br" in kw["precompress"] and brotli is None:
+            # Otherwise the .br targets would never exist, and every task would run on every build
+            req_missing(['brotli'], 'precompress the search index with Brotli', optional=True)
+            kw["precompress"] = [fmt for fmt in kw["precompress"] if fmt != "br"]
 
         posts = self.site.timeline[:]
-        dst_path = os.path.join(kw["output_folder"], "assets", "js",
-                                "tipuesearch_content.json")
+        js_folder = os.path.join(kw["output_folder"], "assets", "js")
+        dst_path = os.path.join(js_folder, "tipuesearch_content.json")
 
-        def save_data():
-            pages = []
+        if kw["split"]:
+            # One set of shards per language; tipuesearch_content.json only
+            # tells the client which shards belong to which language.
+            manifest = {"default": self.site.config['DEFAULT_LANG'], "languages": {}}
             for lang in kw["translations"]:
-                for post in posts:
-                    # Don't index drafts (Issue #387)
-                    if post.is_draft or post.is_private or post.publish_later:
-                        continue
-                    text = post.text(lang, strip_html=True)
-                    text = text.replace('^', '')
-
-                    data = {}
-                    data["title"] = post.title(lang)
-                    data["text"] = text
-                    data["tags"] = ",".join(post.tags)
-                    data["loc"] = post.permalink(lang)
-                    pages.append(data)
-            output = json.dumps({"pages": pages}, indent=2)
-            makedirs(os.path.dirname(dst_path))
-            with codecs.open(dst_path, "wb+", "utf8") as fd:
-                fd.write(output)
-
-        yield {
-            "basename": str(self.name),
-            "name": dst_path,
-            "targets": [dst_path],
-            "actions": [(save_data, [])],
-            'uptodate': [config_changed(kw), result_dep('sitemap')]
-        }
-        # Note: The task should run everytime a new file is added or a
-        # file is changed.  We cheat, and depend on the sitemap task,
-        # to run everytime a new file is added.
+                indexed = [post for post in posts if _is_indexed(post, lang, kw["untranslated"])]
+                count = max(1, (len(indexed) + kw["shard_size"] - 1) // kw["shard_size"])
+                names = ["tipuesearch_content.{0}.{1}.json".format(lang, i) for i in range(count)]
+                manifest["languages"][lang] = names
+                dst_paths = [os.path.join(js_folder, name) for name in names]
+                yield self.records_task(kw, posts, [lang], dst_paths, self.write_content, (dst_paths, kw["shard_size"], kw))
+            yield self.manifest_task(kw, dst_path, manifest)
+        else:
+            yield self.records_task(kw, posts, list(kw["translations"]), [dst_path], self.write_content, ([dst_path], None, kw))
+
+        if kw["inverted_index"]:
+            index_path = os.path.join(js_folder, "tipuesearch_index.json")
+            manifest = {"default": self.site.config['DEFAULT_LANG'], "languages": {}}
+            for lang in kw["translations"]:
+                name = "tipuesearch_index.{0}.json".format(lang)
+                manifest["languages"][lang] = name
+                lang_path = os.path.join(js_folder, name)
+                yield self.records_task(kw, posts, [lang], [lang_path], self.write_inverted_index, (lang_path, lang, kw))
+            yield self.manifest_task(kw, index_path, manifest)
 
         # Copy all the assets to the right places
         asset_folder = os.path.join(os.path.dirname(__file__), "files")
         for task in copy_tree(asset_folder, kw["output_folder"]):
             task["basename"] = str(self.name)
             yield task
+
+    def with_precompressed(self, paths, kw):
+        """Add the precompressed siblings of the given files."""
+        return paths + ["{0}.{1}".format(path, fmt) for path in paths for fmt in kw["precompress"]]
+
+    def write_json(self, path, data, precompress):
+        makedirs(os.path.dirname(path))
+        with codecs.open(path, "wb+", "utf8") as fd:
+            fd.write(_dumps(data))
+        _precompress(path, precompress)
+
+    def write_content(self, shards, dst_paths, shard_size, kw):
+        """Write the Tipue pages to dst_paths, shard_size pages per file.
+
+        If shard_size is None, there is a single output file; otherwise
+        shards left over from an earlier build are removed.  Cached records
+        are read and written one by one, so memory use does not grow with
+        the size of the site.  The full text is kept in the cache, but only
+        the first LOCAL_SEARCH_TEXT_LENGTH characters are written.
+        """
+        locs = []
+        sizes = []
+
+        def pages():
+            for shard_path in shards:
+                page = _read_shard(shard_path)
+                page["text"] = _truncate(page["text"], kw["text_length"])
+                locs.append(page["loc"])
+                yield page
+
+        records = pages()
+        for path in dst_paths:
+            _write_json_stream(path, [("pages", "list", itertools.islice(records, shard_size))], sizes)
+            _precompress(path, kw["precompress"])
+        if shard_size is not None:
+            _remove_stale_shards(dst_paths, self.with_precompressed(dst_paths, kw))
+        _check_size_budget(dst_paths, kw["size_budget"], list(zip(sizes, locs)), "chars")
+
+    def get_tokenizer(self, lang):
+        """Create the tokenizer configured for a language in LOCAL_SEARCH_TOKENIZER."""
+        options = dict(self.site.config.get('LOCAL_SEARCH_TOKENIZER', {}).get(lang, {}))
+        if options.get("stemmer") and inverted_index.snowballstemmer is None:
+            req_missing(['snowballstemmer'], 'stem the search index', optional=True)
+            options.pop("stemmer")
+        return inverted_index.Tokenizer(**options)
+
+    def write_inverted_index(self, shards, dst_path, lang, kw):
+        builder = inverted_index.IndexBuilder(self.get_tokenizer(lang), kw["field_boosts"],
+                                              kw["text_length"] or inverted_index.SNIPPET_LENGTH)
+        contributors = []
+        for shard_path in shards:
+            record = _read_shard(shard_path)
+            contributors.append((builder.add(record), record["loc"]))
+        _write_json_stream(dst_path, builder.json_members())
+        _precompress(dst_path, kw["precompress"])
+        _check_size_budget([dst_path], kw["size_budget"], contributors, "terms")
+
+    def load_records(self, lang):
+        """Return the cached records of a language, as left by the last build."""
+        lang_folder = os.path.join(self.site.config['CACHE_FOLDER'], "local_search", lang)
+        if not os.path.isdir(lang_folder):
+            return []
+        return [_read_shard(os.path.join(lang_folder, filename))
+                for filename in sorted(os.listdir(lang_folder)) if filename.endswith(".json")]
+
+    def search_index(self, lang):
+        """Return a query.SearchIndex for a language.
+
+        Uses the inverted index in the output folder if it was built, and
+        indexes the cached records in memory otherwise.
+        """
+        index_path = os.path.join(self.site.config['OUTPUT_FOLDER'], "assets", "js",
+                                  "tipuesearch_index.{0}.json".format(lang))
+        if os.path.isfile(index_path):
+            return query.SearchIndex.load(index_path, self.get_tokenizer(lang))
+        return query.SearchIndex.from_records(self.load_records(lang), self.get_tokenizer(lang),
+                                              self.site.config.get('LOCAL_SEARCH_FIELD_BOOSTS'))
+
+    def benchmark(self, lang, sizes, queries):
+        """Benchmark indexes over corpora of the given sizes, made from the cached records."""
+        return query.benchmark(self.load_records(lang), self.get_tokenizer(lang), sizes, queries,
+                               self.site.config.get('LOCAL_SEARCH_FIELD_BOOSTS'))
+
+    def manifest_task(self, kw, dst_path, manifest):
+        """Create the task writing a manifest listing the files of each language."""
+        return {
+            "basename": str(self.name),
+            "name": dst_path,
+            "targets": self.with_precompressed([dst_path], kw),
+            "actions": [(self.write_json, [dst_path, manifest, kw["precompress"]])],
+            "uptodate": [config_changed(kw), config_changed(manifest, "local_search:manifest")]
+        }
+
+    def update_shards(self, indexed, langs):
+        """Make sure the records of the indexed posts are cached, and return their paths.
+
+        Only the records whose shard key changed are extracted, and shards
+        which no longer belong to any post are dropped.
+        """
+        shard_folder = os.path.join(self.site.config['CACHE_FOLDER'], "local_search")
+        for lang in langs:
+            makedirs(os.path.join(shard_folder, lang))
+        shards = []
+        missing = []
+        for post, lang in indexed:
+            shard_path = os.path.join(shard_folder, lang, _shard_key(post, lang) + ".json")
+            if not os.path.isfile(shard_path):
+                missing.append((post, lang, shard_path))
+            shards.append(shard_path)
+        workers = self.site.config.get('LOCAL_SEARCH_WORKERS') or multiprocessing.cpu_count()
+        records = _extract_records([(post, lang) for post, lang, shard_path in missing], workers)
+        for record, (post, lang, shard_path) in zip(records, missing):
+            _write_shard(shard_path, record)
+        used = set(shards)
+        for lang in langs:
+            lang_folder = os.path.join(shard_folder, lang)
+            for filename in os.listdir(lang_folder):
+                path = os.path.join(lang_folder, filename)
+                if filename.endswith(".json") and path not in used:
+                    os.unlink(path)
+        return shards
+
+    def records_task(self, kw, posts, langs, dst_paths, write, write_args):
+        """Create a task writing dst_paths from the records of posts in the given languages.
+
+        write is called with the list of shard paths, followed by write_args.
+        """
+        # The output only changes if one of these fingerprints or one of the
+        # compiled fragments changes, so depend on exactly that.
+        fingerprint = []
+        fragments = set()
+        indexed = []
+        for lang in langs:
+            for post in posts:
+                fingerprint.append(_post_fingerprint(post, lang))
+                if _is_indexed(post, lang, kw["untranslated"]):
+                    indexed.append((post, lang))
+                    fragments.add(_fragment_path(post, lang))
+
+        def save_data():
+            write(self.update_shards(indexed, langs), *write_args)
+
+        return {
+            "basename": str(self.name),
+            "name": dst_paths[0],
+            "targets": self.with_precompressed(dst_paths, kw),
+            "file_dep": sorted(fragments),
+            "actions": [(save_data, [])],
+            "uptodate": [config_changed(kw), config_changed({"posts": fingerprint}, "local_search:posts")]
+        }
@@ -23,7 +23,8 @@ http://www.tipue.com/search
                'mode'                   : 'static',
                'liveDescription'        : '*',
                'liveContent'            : '*',
-               'contentLocation'        : 'tipuesearch/tipuesearch_content.json'
+               'contentLocation'        : 'tipuesearch/tipuesearch_content.json',
+               'lang'                   : ''
 
           }, options);
 
@@ -32,6 +33,7 @@ http://www.tipue.com/search
                var tipuesearch_in = {
                     pages: []
                };
+               var tipuesearch_index = null;
                $.ajaxSetup({
                     async: false
                });
@@ -78,6 +80,54 @@ http://www.tipue.com/search
                               tipuesearch_in = $.extend({}, json);
                          }
                     );
+                    // A split index only lists the shards of each language;
+                    // load the shards of the page's language.
+                    if (tipuesearch_in.languages)
+                    {
+                         var shards = tipuesearch_in.languages[getManifestLang(tipuesearch_in)];
+                         var base = set.contentLocation.substring(0, set.contentLocation.lastIndexOf('/') + 1);
+                         tipuesearch_in = {
+                              pages: []
+                         };
+                         for (var i = 0; i < shards.length; i++)
+                         {
+                              $.getJSON(base + shards[i],
+                                   function(json)
+                                   {
+                                        tipuesearch_in.pages = tipuesearch_in.pages.concat(json.pages);
+                                   }
+                              );
+                         }
+                    }
+               }
+
+               if (set.mode == 'index')
+               {
+                    // contentLocation points to the manifest of the
+                    // per-language inverted indexes.
+                    var manifest = {};
+                    $.getJSON(set.contentLocation,
+                         function(json)
+                         {
+                              manifest = json;
+                         }
+                    );
+                    var base = set.contentLocation.substring(0, set.contentLocation.lastIndexOf('/') + 1);
+                    $.getJSON(base + manifest.languages[getManifestLang(manifest)],
+                         function(json)
+                         {
+                              tipuesearch_index = json;
+                         }
+                    );
+                    tipuesearch_index.keys = [];
+                    for (var term in tipuesearch_index.terms)
+                    {
+                         if (tipuesearch_index.terms.hasOwnProperty(term))
+                         {
+                              tipuesearch_index.keys.push(term);
+                         }
+                    }
+                    tipuesearch_index.keys.sort();
                }
 
                if (set.mode == 'static')
@@ -85,6 +135,109 @@ http://www.tipue.com/search
                     tipuesearch_in = $.extend({}, tipuesearch);
                }
 
+               function getManifestLang(manifest)
+               {
+                    var lang = set.lang || $('html').attr('lang');
+                    if (!manifest.languages[lang])
+                    {
+                         lang = manifest['default'];
+                    }
+                    return lang;
+               }
+
+               function getIndexTerms(word)
+               {
+                    // Return the index terms matching a query word: its stem,
+                    // or else the terms it is a prefix of.
+                    var term = tipuesearch_index.stems[word] || word;
+                    if (tipuesearch_index.terms.hasOwnProperty(term))
+                    {
+                         return [term];
+                    }
+                    var keys = tipuesearch_index.keys;
+                    var lo = 0;
+                    var hi = keys.length;
+                    while (lo < hi)
+                    {
+                         var mid = (lo + hi) >> 1;
+                         if (keys[mid] < word)
+                         {
+                              lo = mid + 1;
+                         }
+                         else
+                         {
+                              hi = mid;
+                         }
+                    }
+                    var terms = [];
+                    while (lo < keys.length && terms.length < 50 && keys[lo].lastIndexOf(word, 0) == 0)
+                    {
+                         terms.push(keys[lo++]);
+                    }
+                    return terms;
+               }
+
+               function getIndexHits(d_w)
+               {
+                    // Map page ids to the number of matched query words and
+                    // the sum of their weights.
+                    var hits = {};
+                    for (var f = 0; f < d_w.length; f++)
+                    {
+                         var words = d_w[f].split(/[\s!-\/:-@\[-`{-~\u00a0-\u00bf\u2000-\u206f\u3000-\u303f]+/);
+                         for (var w = 0; w < words.length; w++)
+                         {
+                              if (!words[w])
+                              {
+                                   continue;
+                              }
+                              var matched = {};
+                              var terms = getIndexTerms(words[w]);
+                              for (var t = 0; t < terms.length; t++)
+                              {
+                                   var postings = tipuesearch_index.terms[terms[t]];
+                                   for (var p = 0; p < postings.length; p += 2)
+                                   {
+                                        if (!matched[postings[p]] || matched[postings[p]] < postings[p + 1])
+                                        {
+                                             matched[postings[p]] = postings[p + 1];
+                                        }
+                                   }
+                              }
+                              for (var id in matched)
+                              {
+                                   if (!hits[id])
+                                   {
+                                        hits[id] = {count: 0, weight: 0};
+                                   }
+                                   hits[id].count++;
+                                   hits[id].weight += matched[id];
+                              }
+                         }
+                    }
+                    return hits;
+               }
+
+               function highlight(s_t, d_w)
+               {
+                    if (set.highlightTerms)
+                    {
+                         for (var f = 0; f < d_w.length; f++)
+                         {
+                              if (set.highlightEveryTerm)
+                              {
+                                   var patr = new RegExp('(' + d_w[f] + ')', 'gi');
+                              }
+                              else
+                              {
+                                   var patr = new RegExp('(' + d_w[f] + ')', 'i');
+                              }
+                              s_t = s_t.replace(patr, "<b>$1</b>");
+                         }
+                    }
+                    return s_t;
+               }
+
                var tipue_search_w = '';
                if (set.newWindow)
                {
@@ -178,6 +331,18 @@ http://www.tipue.com/search
 
                          var c = 0;
                          found = new Array();
+                         if (tipuesearch_index)
+                         {
+                              // Pages matching more query words rank first,
+                              // then pages with the higher summed weight.
+                              var hits = getIndexHits(d_w);
+                              for (var id in hits)
+                              {
+                                   var page = tipuesearch_index.pages[id];
+                                   var score = 1000000000 - Math.min(hits[id].count, 899) * 1000000 - Math.min(hits[id].weight, 999999);
+                                   found[c++] = score + '^' + page[0] + '^' + highlight(page[3], d_w) + '^' + page[1];
+                              }
+                         }
                          for (var i = 0; i < tipuesearch_in.pages.length; i++)
                          {
                               var score = 1000000000;
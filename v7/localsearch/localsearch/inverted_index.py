@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2012-2014 Roberto Alsina and others.
+
+# Permission is hereby granted, free of charge, to any
+# person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the
+# Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice
+# shall be included in all copies or substantial portions of
+# the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS
+# OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Build an inverted index over local_search records.
+
+The index is a JSON object of this form:
+
+{"pages": [[title, loc, tags, snippet], ...],
+ "terms": {term: [page_id, weight, page_id, weight, ...], ...},
+ "stems": {word: term, ...}}
+
+Posting lists are sorted by page id.  "stems" maps the words which occur in
+the indexed pages to their stems, for those words where they differ, so that
+clients can normalize queries without a stemmer of their own.
+"""
+
+from __future__ import unicode_literals
+from collections import Counter
+import re
+
+try:
+    import snowballstemmer
+except ImportError:
+    snowballstemmer = None  # NOQA
+
+DEFAULT_TOKEN_PATTERN = r'[^\W_]+'
+DEFAULT_FIELD_BOOSTS = {"title": 10, "tags": 5, "text": 1}
+SNIPPET_LENGTH = 300
+
+# Cap the term frequency taken from the text, so long posts which
+# repeat a word over and over do not drown everything else.
+_MAX_TEXT_TF = 10
+
+
+class Tokenizer(object):
+    """Split text into lowercased and (optionally) stemmed terms."""
+
+    def __init__(self, pattern=DEFAULT_TOKEN_PATTERN, stemmer=None, min_length=1):
+        """Create a tokenizer.
+
+        pattern is the regular expression matching a single word, stemmer the
+        name of a Snowball stemmer (needs the snowballstemmer package), and
+        min_length the length below which words are ignored.
+        """
+        self.pattern = re.compile(pattern, re.UNICODE)
+        self.min_length = min_length
+        self.stemmer = snowballstemmer.stemmer(stemmer) if stemmer else None
+        self.stems = {}
+
+    def words(self, text):
+        return [m.group(0).lower() for m in self.pattern.finditer(text) if len(m.group(0)) >= self.min_length]
+
+    def stem(self, word):
+        if self.stemmer is None:
+            return word
+        stem = self.stems.get(word)
+        if stem is None:
+            stem = self.stems[word] = self.stemmer.stemWord(word)
+        return stem
+
+    def terms(self, text):
+        return [self.stem(word) for word in self.words(text)]
+
+
+class IndexBuilder(object):
+    """Collect records and turn them into an inverted index."""
+
+    def __init__(self, tokenizer, field_boosts=None, snippet_length=SNIPPET_LENGTH):
+        self.tokenizer = tokenizer
+        self.field_boosts = field_boosts or DEFAULT_FIELD_BOOSTS
+        self.snippet_length = snippet_length
+        self.pages = []
+        self.terms = {}
+
+    def add(self, record):
+        """Add a record (a dict with title, text, tags and loc).
+
+        Returns the number of distinct terms the record was indexed under.
+        """
+        page_id = len(self.pages)
+        weights = {}
+        for field in ("title", "tags", "text"):
+            boost = self.field_boosts.get(field, 1)
+            for term, tf in Counter(self.tokenizer.terms(record[field])).items():
+                if field == "text":
+                    tf = min(tf, _MAX_TEXT_TF)
+                weights[term] = weights.get(term, 0) + boost * tf
+        for term, weight in weights.items():
+            self.terms.setdefault(term, []).extend([page_id, weight])
+        self.pages.append([record["title"], record["loc"], record["tags"], record["text"][:self.snippet_length]])
+        return len(weights)
+
+    def json_members(self):
+        """Return the members of the index as (name, kind, items), in the form _write_json_stream expects."""
+        stems = sorted((word, stem) for word, stem in self.tokenizer.stems.items() if word != stem)
+        return [("pages", "list", self.pages),
+                ("terms", "dict", sorted(self.terms.items())),
+                ("stems", "dict", stems)]
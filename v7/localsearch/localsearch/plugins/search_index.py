@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2012-2014 Roberto Alsina and others.
+
+# Permission is hereby granted, free of charge, to any
+# person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the
+# Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice
+# shall be included in all copies or substantial portions of
+# the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS
+# OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import print_function, unicode_literals
+import time
+
+from nikola.plugin_categories import Command
+from nikola.utils import get_logger, STDERR_HANDLER
+
+
+class CommandSearchIndex(Command):
+    """Query the local_search index."""
+
+    name = "search_index"
+
+    doc_usage = "[options] query"
+    doc_purpose = "query or benchmark the local_search index"
+    doc_description = ("Run a query against the index built by the local_search plugin, or "
+                       "measure build time, size and queries/second of the index for several corpus sizes.")
+
+    logger = get_logger('search_index', STDERR_HANDLER)
+
+    cmd_options = [
+        {
+            'name': 'lang',
+            'short': 'l',
+            'long': 'lang',
+            'type': str,
+            'default': '',
+            'help': 'Language of the index to use (default: DEFAULT_LANG)',
+        },
+        {
+            'name': 'limit',
+            'short': 'n',
+            'long': 'limit',
+            'type': int,
+            'default': 10,
+            'help': 'Number of results to show (default: 10)',
+        },
+        {
+            'name': 'benchmark',
+            'short': 'b',
+            'long': 'benchmark',
+            'type': bool,
+            'default': False,
+            'help': 'Benchmark the index instead of running a query',
+        },
+        {
+            'name': 'sizes',
+            'long': 'sizes',
+            'type': str,
+            'default': '1000,10000,100000',
+            'help': 'Comma-separated corpus sizes (in pages) to benchmark (default: 1000,10000,100000)',
+        },
+        {
+            'name': 'queries',
+            'long': 'queries',
+            'type': int,
+            'default': 1000,
+            'help': 'Number of queries per corpus size (default: 1000)',
+        },
+    ]
+
+    def _execute(self, options, args):
+        plugin_info = self.site.plugin_manager.getPluginByName('local_search', 'LateTask')
+        if plugin_info is None:
+            self.logger.error("The local_search plugin is not installed.")
+            return 1
+        tipue = plugin_info.plugin_object
+        lang = options['lang'] or self.site.config['DEFAULT_LANG']
+
+        if options['benchmark']:
+            if not tipue.load_records(lang):
+                self.logger.error("No cached search records for language '{0}'; run 'nikola build' first.".format(lang))
+                return 1
+            sizes = [int(size) for size in options['sizes'].split(',')]
+            for result in tipue.benchmark(lang, sizes, options['queries']):
+                print("{pages:>8} pages {terms:>9} terms {index_bytes:>11} bytes   "
+                      "build {build_seconds:7.2f} s {queries_per_second:>10.0f} queries/s".format(**result))
+            return
+
+        if not args:
+            print(self.help())
+            return 1
+        index = tipue.search_index(lang)
+        start = time.time()
+        results = index.search(' '.join(args), options['limit'])
+        elapsed = time.time() - start
+        for page, count, weight in results:
+            print("{0:>6}  {1}\n        {2}".format(weight, page[0], page[1]))
+        print("{0} result(s) in {1:.3f} ms".format(len(results), elapsed * 1000))
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2012-2014 Roberto Alsina and others.
+
+# Permission is hereby granted, free of charge, to any
+# person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the
+# Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice
+# shall be included in all copies or substantial portions of
+# the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS
+# OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Answer queries from an inverted index as built by inverted_index.
+
+Ranking is the same as in the bundled Tipue client's 'index' mode: pages
+matching more query words come first, then pages with the higher summed
+weight.  Words which are not an index term are matched as prefixes.
+"""
+
+from __future__ import unicode_literals
+import bisect
+import io
+import json
+import random
+import time
+
+from . import inverted_index
+
+# Same limit as in tipuesearch.js
+MAX_PREFIX_TERMS = 50
+
+
+class SearchIndex(object):
+    """An inverted index which can be queried."""
+
+    def __init__(self, data, tokenizer):
+        """Wrap index data (the JSON object written by local_search)."""
+        self.pages = data["pages"]
+        self.terms = data["terms"]
+        self.stems = data.get("stems", {})
+        self.tokenizer = tokenizer
+        self.keys = sorted(self.terms)
+
+    @classmethod
+    def load(cls, path, tokenizer):
+        with io.open(path, "rb") as fd:
+            return cls(json.loads(fd.read().decode('utf-8')), tokenizer)
+
+    @classmethod
+    def from_records(cls, records, tokenizer, field_boosts=None):
+        """Build an index in memory from local_search records."""
+        builder = inverted_index.IndexBuilder(tokenizer, field_boosts)
+        for record in records:
+            builder.add(record)
+        return cls(dict((name, dict(items) if kind == "dict" else items)
+                        for name, kind, items in builder.json_members()), tokenizer)
+
+    def lookup(self, word):
+        """Return the index terms matching a (lowercased) query word.
+
+        Like the client, only the stems shipped with the index are used, so
+        words which do not occur in the indexed pages are not stemmed.
+        """
+        term = self.stems.get(word, word)
+        if term in self.terms:
+            return [term]
+        result = []
+        i = bisect.bisect_left(self.keys, word)
+        while i < len(self.keys) and len(result) < MAX_PREFIX_TERMS and self.keys[i].startswith(word):
+            result.append(self.keys[i])
+            i += 1
+        return result
+
+    def search(self, query, limit=10):
+        """Return up to limit (page, matched words, weight) tuples, best first.
+
+        page is the [title, loc, tags, snippet] entry of the index.
+        """
+        hits = {}
+        for word in self.tokenizer.words(query):
+            matched = {}
+            for term in self.lookup(word):
+                postings = self.terms[term]
+                for i in range(0, len(postings), 2):
+                    if matched.get(postings[i], 0) < postings[i + 1]:
+                        matched[postings[i]] = postings[i + 1]
+            for page_id, weight in matched.items():
+                count, total = hits.get(page_id, (0, 0))
+                hits[page_id] = (count + 1, total + weight)
+        best = sorted(hits.items(), key=lambda hit: (-hit[1][0], -hit[1][1], hit[0]))[:limit]
+        return [(self.pages[page_id], count, weight) for page_id, (count, weight) in best]
+
+
+def benchmark(records, tokenizer, sizes, queries=1000, field_boosts=None, seed=0):
+    """Measure index build time, size and query throughput for several corpus sizes.
+
+    Corpora of the given sizes are taken from records, repeating them if
+    there are not enough.  Queries consist of one or two words picked from
+    the corpus vocabulary.  Returns a list of dicts, one per size.
+    """
+    rng = random.Random(seed)
+    results = []
+    for size in sizes:
+        corpus = [records[i % len(records)] for i in range(size)]
+        start = time.time()
+        index = SearchIndex.from_records(corpus, tokenizer, field_boosts)
+        build_time = time.time() - start
+        index_bytes = len(json.dumps({"pages": index.pages, "terms": index.terms, "stems": index.stems},
+                                     separators=(',', ':')).encode('utf-8'))
+        vocabulary = index.keys or [""]
+        workload = [" ".join(rng.choice(vocabulary) for _ in range(rng.randint(1, 2))) for _ in range(queries)]
+        start = time.time()
+        for query in workload:
+            index.search(query)
+        query_time = time.time() - start
+        results.append({
+            "pages": size,
+            "terms": len(index.terms),
+            "index_bytes": index_bytes,
+            "build_seconds": build_time,
+            "queries_per_second": queries / query_time if query_time else float("inf"),
+        })
+    return results
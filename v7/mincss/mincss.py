@@ -25,16 +25,103 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 from __future__ import print_function, unicode_literals
+import hashlib
+import io
+import json
+import multiprocessing
 import os
 import sys
+import time
 
 try:
     from mincss.processor import Processor
+    from lxml import etree
+    from lxml.cssselect import CSSSelector
 except ImportError:
     Processor = None
 
 from nikola.plugin_categories import Command
-from nikola.utils import req_missing, get_logger, STDERR_HANDLER
+from nikola.utils import makedirs, req_missing, get_logger, STDERR_HANDLER
+
+# Bump when the format of the cache changes
+CACHE_VERSION = 1
+
+
+def _hash(data):
+    return hashlib.md5(data).hexdigest()
+
+
+def css_selectors(content):
+    """Return the (simplified) selectors mincss looks up for a stylesheet."""
+    selectors = set()
+
+    def record(selector):
+        selectors.add(selector)
+        return True
+
+    _LookupProcessor(record)._process_content(content, [])
+    return selectors
+
+
+def minimize_css(content, used):
+    """Remove the selectors not in used from a stylesheet, the way mincss does."""
+    return _LookupProcessor(lambda selector: selector in used)._process_content(content, [])
+
+
+def analyze_page(html, selectors):
+    """Find the stylesheets an HTML page links to and the selectors it uses.
+
+    selectors is a sorted list.  Returns a list of (href, data-mincss
+    attribute) pairs, and the indexes of the selectors mincss would find in
+    the page.
+    """
+    html = html.decode('utf-8').strip().encode('utf-8')
+    page = etree.fromstring(html, etree.HTMLParser(encoding='utf-8')).getroottree().getroot()
+    links = []
+    for link in CSSSelector('link')(page):
+        href = link.attrib.get('href', '')
+        if link.attrib.get('rel', '') == 'stylesheet' or href.lower().split('?')[0].endswith('.css'):
+            links.append((href, link.attrib.get('data-mincss', '').lower()))
+    body, = CSSSelector('body')(page)
+    # Same lookup as mincss, as if this was the only page
+    processor = Processor(preserve_remote_urls=False)
+    processor._all_tags.add('body')
+    processor._find_all_ids_classes_and_tags(body)
+    found = [i for i, selector in enumerate(selectors) if processor._found([body], selector)]
+    return links, found
+
+
+# The selectors the pages are analyzed for, set once per worker process
+_SELECTORS = None
+
+
+def _init_worker(selectors):
+    global _SELECTORS
+    _SELECTORS = selectors
+
+
+def analyze_shard(shard):
+    """Analyze a (number, [(key, path), ...]) shard of pages; return the number, results and time taken."""
+    number, pages = shard
+    start = time.time()
+    results = []
+    for key, path in pages:
+        with io.open(path, 'rb') as inf:
+            links, found = analyze_page(inf.read(), _SELECTORS)
+        results.append((key, links, found))
+    return number, results, time.time() - start
+
+
+if Processor is not None:
+    class _LookupProcessor(Processor):
+        """A mincss Processor which asks a function instead of the pages whether a selector is used."""
+
+        def __init__(self, lookup):
+            super(_LookupProcessor, self).__init__(preserve_remote_urls=False)
+            self.lookup = lookup
+
+        def _found(self, bodies, selector):
+            return self.lookup(selector)
 
 
 class CommandMincss(Command):
@@ -46,15 +133,26 @@ class CommandMincss(Command):
 
     logger = get_logger('mincss', STDERR_HANDLER)
 
+    cmd_options = [
+        {
+            'name': 'jobs',
+            'long': 'jobs',
+            'short': 'j',
+            'default': 0,
+            'type': int,
+            'help': 'Number of processes analyzing pages (default: number of CPUs)',
+        },
+    ]
+
     def _execute(self, options, args):
         """Apply mincss the generated site."""
         output_folder = self.site.config['OUTPUT_FOLDER']
+        cache_file = os.path.join(self.site.config['CACHE_FOLDER'], 'mincss.json')
         if Processor is None:
             req_missing(['mincss'], 'use the "mincss" command')
             return
 
-        p = Processor(preserve_remote_urls=False)
-        urls = []
+        pages = []
         css_files = {}
         for root, dirs, files in os.walk(output_folder, followlinks=True):
             for f in files:
@@ -67,9 +165,111 @@ class CommandMincss(Command):
                     css_files[fname] = url
                 if not f.endswith('.html'):
                     continue
-                urls.append(url)
-        p.process(*urls)
-        for inline in p.links:
-            fname = os.path.basename(inline.href)
-            with open(css_files[fname], 'wb+') as outf:
-                outf.write(inline.after)
+                pages.append(url)
+
+        css = {}
+        for fname, path in css_files.items():
+            with io.open(path, 'rb') as inf:
+                css[fname] = inf.read().decode('utf-8')
+        selectors = set()
+        for content in css.values():
+            selectors |= css_selectors(content)
+        selectors = sorted(selectors)
+        universe = _hash(json.dumps(selectors).encode('utf-8'))
+
+        # The selectors each page uses are cached by the hash of the page, together with
+        # the selectors the page was checked for.  Only new and changed pages are analyzed,
+        # or all of them if the CSS gained selectors.
+        cache = self.load_cache(cache_file)
+        universes = {universe: selectors}
+        for key, checked in cache['universes'].items():
+            if set(selectors) <= set(checked):
+                universes[key] = checked
+        results = {}
+        todo = {}
+        for path in pages:
+            with io.open(path, 'rb') as inf:
+                key = _hash(inf.read())
+            entry = cache['pages'].get(key)
+            if entry is None or entry['universe'] not in universes:
+                todo[key] = path
+            else:
+                results[key] = entry
+        for key, links, found in self.analyze_pages(sorted(todo.items()), selectors, options.get('jobs') or 0):
+            results[key] = {'universe': universe, 'links': links, 'found': found}
+        self.logger.info("Analyzed {0} of {1} pages, the others were unchanged".format(len(todo), len(pages)))
+
+        used = set()
+        linked = {}
+        for entry in results.values():
+            checked = universes[entry['universe']]
+            used.update(checked[i] for i in entry['found'])
+            for href, mode in entry['links']:
+                if mode != 'ignore':
+                    fname = os.path.basename(href.split('?')[0])
+                    linked[fname] = linked.get(fname, False) or mode == 'no'
+        for fname, no_mincss in sorted(linked.items()):
+            if no_mincss or fname not in css_files:
+                continue
+            after = minimize_css(css[fname], used).encode('utf-8')
+            if after != css[fname].encode('utf-8'):
+                with open(css_files[fname], 'wb+') as outf:
+                    outf.write(after)
+
+        self.save_cache(cache_file, {
+            'version': CACHE_VERSION,
+            'universes': dict((entry['universe'], universes[entry['universe']]) for entry in results.values()),
+            'pages': results,
+        })
+
+    def analyze_pages(self, pages, selectors, jobs):
+        """Analyze (key, path) pages in shards, spread over jobs processes.
+
+        The pages are analyzed independently, so the results are the same
+        however they are sharded.
+        """
+        jobs = jobs or multiprocessing.cpu_count()
+        if not pages:
+            return []
+        # More shards than processes, so a shard of slow pages doesn't hold up the others
+        count = min(len(pages), jobs * 4 if jobs > 1 else 1)
+        shards = [(number, pages[number::count]) for number in range(count)]
+        pool = None
+        # Workers must be forked: spawned ones could not import this module, which yapsy loaded
+        if jobs > 1 and hasattr(os, 'fork'):
+            try:
+                try:
+                    pool = multiprocessing.get_context('fork').Pool(jobs, _init_worker, (selectors,))
+                except AttributeError:  # Python 2 always forks
+                    pool = multiprocessing.Pool(jobs, _init_worker, (selectors,))
+            except (AssertionError, OSError):  # e.g. when running in a daemonic process
+                pool = None
+        if pool is not None:
+            try:
+                done = list(pool.imap_unordered(analyze_shard, shards))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            _init_worker(selectors)
+            done = [analyze_shard(shard) for shard in shards]
+        results = []
+        for number, shard_results, elapsed in sorted(done):
+            self.logger.info("Shard {0}: {1} pages in {2:.2f}s".format(number, len(shard_results), elapsed))
+            results.extend(shard_results)
+        return results
+
+    def load_cache(self, cache_file):
+        try:
+            with io.open(cache_file, 'rb') as inf:
+                cache = json.loads(inf.read().decode('utf-8'))
+            if cache.get('version') == CACHE_VERSION:
+                return cache
+        except (IOError, ValueError):
+            pass
+        return {'universes': {}, 'pages': {}}
+
+    def save_cache(self, cache_file, cache):
+        makedirs(os.path.dirname(cache_file))
+        with io.open(cache_file, 'wb') as outf:
+            outf.write(json.dumps(cache, sort_keys=True, separators=(',', ':')).encode('utf-8'))
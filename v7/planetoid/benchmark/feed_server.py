@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2012-2014 Roberto Alsina and others.
+
+# Permission is hereby granted, free of charge, to any
+# person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the
+# Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice
+# shall be included in all copies or substantial portions of
+# the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS
+# OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""A local HTTP server serving synthetic feeds, to exercise planetoid offline.
+
+Feed number n is served at /feed/<n>.xml.  Every feed starts with a number of
+entries; advance() adds a new entry to some of the feeds, the way real feeds
+change between two refreshes.  Some feeds can be made to fail with a server
+error, or to hang until the client gives up.
+
+Run it standalone to point a test planet at it:
+
+    python feed_server.py --feeds 100 --port 8000 > feeds
+"""
+
+from __future__ import print_function, unicode_literals
+from email.utils import formatdate
+from optparse import OptionParser
+import random
+import threading
+import time
+from xml.sax.saxutils import escape
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # NOQA
+    from socketserver import ThreadingMixIn  # NOQA
+
+# Entry dates start here and are a day apart
+_EPOCH = 1400000000
+
+_WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut '
+          'labore et dolore magna aliqua planet feed nikola python static site entry').split()
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FeedServer(object):
+    """Serve synthetic RSS and Atom feeds on localhost."""
+
+    def __init__(self, feeds=100, entries=20, entry_size=2000, latency=0.0, feed_format='mixed',
+                 errors=0.0, hangs=0.0, hang_time=60.0, etags=True, changes=0.1, port=0, seed=0):
+        """Create the server; call start() to begin serving.
+
+        feeds is the number of feeds, entries the number of entries each one
+        starts with, and entry_size the approximate size of an entry's text
+        in bytes.  Every response is delayed by latency seconds.  feed_format
+        is 'rss', 'atom' or 'mixed'.  The fraction errors of the feeds answer
+        with a 500 error, and the fraction hangs of them waits hang_time
+        seconds before answering.  With etags, responses carry ETag and
+        Last-Modified headers and conditional requests get a 304 when the
+        feed did not change.  changes is the fraction of the feeds advance()
+        adds an entry to.
+        """
+        self.feeds = feeds
+        self.entry_size = entry_size
+        self.latency = latency
+        self.feed_format = feed_format
+        self.hang_time = hang_time
+        self.etags = etags
+        self.changes = changes
+        self.rng = random.Random(seed)
+        broken = self.rng.sample(range(feeds), int(feeds * errors) + int(feeds * hangs))
+        self.failing = set(broken[:int(feeds * errors)])
+        self.hanging = set(broken[int(feeds * errors):])
+        self.entries = [entries] * feeds
+        self.versions = [0] * feeds
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'not_modified': 0, 'errors': 0, 'bytes': 0}
+        self.server = _Server(('127.0.0.1', port), self._handler())
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @property
+    def urls(self):
+        return ['http://127.0.0.1:{0}/feed/{1}.xml'.format(self.port, n) for n in range(self.feeds)]
+
+    def feeds_file(self):
+        """Return the contents of a planetoid feeds file listing all feeds."""
+        return ''.join('{0}\nFeed {1}\n'.format(url, n) for n, url in enumerate(self.urls))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def advance(self):
+        """Add an entry to a random selection of the feeds."""
+        with self.lock:
+            for n in self.rng.sample(range(self.feeds), int(self.feeds * self.changes)):
+                self.entries[n] += 1
+                self.versions[n] += 1
+
+    def reset_stats(self):
+        with self.lock:
+            for key in self.stats:
+                self.stats[key] = 0
+
+    def etag(self, n):
+        return '"{0}-{1}"'.format(n, self.versions[n])
+
+    def last_modified(self, n):
+        return formatdate(_EPOCH + self.entries[n] * 86400, usegmt=True)
+
+    def render(self, n, entries):
+        """Return the feed document of feed n with the given number of entries, as bytes."""
+        feed_format = self.feed_format
+        if feed_format == 'mixed':
+            feed_format = ('rss', 'atom')[n % 2]
+        items = []
+        for i in range(entries - 1, -1, -1):
+            # Seeded per entry, so entries don't change when new ones are added
+            rng = random.Random(n * 1000003 + i)
+            words = []
+            length = 0
+            while length < self.entry_size:
+                word = rng.choice(_WORDS)
+                words.append(word)
+                length += len(word) + 1
+            text = '<p>{0}</p>'.format(' '.join(words))
+            link = 'http://feed{0}.example.com/entry/{1}.html'.format(n, i)
+            date = _EPOCH + i * 86400
+            if feed_format == 'rss':
+                items.append(
+                    '<item><title>Entry {0}</title><link>{1}</link><guid>{1}</guid>'
+                    '<pubDate>{2}</pubDate><description>{3}</description></item>'.format(
+                        i, link, formatdate(date, usegmt=True), escape(text)))
+            else:
+                items.append(
+                    '<entry><title>Entry {0}</title><link href="{1}"/><id>{1}</id>'
+                    '<updated>{2}</updated><content type="html">{3}</content></entry>'.format(
+                        i, link, time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(date)), escape(text)))
+        if feed_format == 'rss':
+            document = ('<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel>'
+                        '<title>Feed {0}</title><link>http://feed{0}.example.com/</link>{1}</channel></rss>')
+        else:
+            document = ('<?xml version="1.0" encoding="utf-8"?><feed xmlns="http://www.w3.org/2005/Atom">'
+                        '<title>Feed {0}</title><id>http://feed{0}.example.com/</id>{1}</feed>')
+        return document.format(n, ''.join(items)).encode('utf-8')
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with server.lock:
+                    server.stats['requests'] += 1
+                try:
+                    n = int(self.path.split('/')[-1].split('.')[0])
+                    if not 0 <= n < server.feeds:
+                        raise ValueError
+                except ValueError:
+                    self.send_error(404)
+                    return
+                if server.latency:
+                    time.sleep(server.latency)
+                if n in server.hanging:
+                    time.sleep(server.hang_time)
+                if n in server.failing:
+                    with server.lock:
+                        server.stats['errors'] += 1
+                    self.send_error(500)
+                    return
+                with server.lock:
+                    etag = server.etag(n)
+                    last_modified = server.last_modified(n)
+                    entries = server.entries[n]
+                if server.etags and self.headers.get('If-None-Match') == etag:
+                    with server.lock:
+                        server.stats['not_modified'] += 1
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                body = server.render(n, entries)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/xml; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                if server.etags:
+                    self.send_header('ETag', etag)
+                    self.send_header('Last-Modified', last_modified)
+                self.end_headers()
+                self.wfile.write(body)
+                with server.lock:
+                    server.stats['bytes'] += len(body)
+
+        return Handler
+
+
+def add_options(parser):
+    """Add the options configuring a FeedServer to an OptionParser."""
+    parser.add_option('--feeds', type='int', default=100, help='number of feeds [default: %default]')
+    parser.add_option('--entries', type='int', default=20, help='entries per feed [default: %default]')
+    parser.add_option('--entry-size', type='int', default=2000, help='bytes of text per entry [default: %default]')
+    parser.add_option('--latency', type='float', default=0.0, help='seconds to delay each response [default: %default]')
+    parser.add_option('--format', dest='feed_format', choices=['rss', 'atom', 'mixed'], default='mixed',
+                      help='rss, atom or mixed [default: %default]')
+    parser.add_option('--errors', type='float', default=0.0, help='fraction of feeds failing with 500 [default: %default]')
+    parser.add_option('--hangs', type='float', default=0.0, help='fraction of feeds which hang [default: %default]')
+    parser.add_option('--hang-time', type='float', default=60.0, help='seconds hanging feeds wait [default: %default]')
+    parser.add_option('--no-etags', dest='etags', action='store_false', default=True,
+                      help='send no validators and never answer 304')
+    parser.add_option('--changes', type='float', default=0.1,
+                      help='fraction of feeds changing between refreshes [default: %default]')
+    parser.add_option('--seed', type='int', default=0, help='random seed [default: %default]')
+
+
+def server_from_options(options, port=0):
+    return FeedServer(feeds=options.feeds, entries=options.entries, entry_size=options.entry_size,
+                      latency=options.latency, feed_format=options.feed_format, errors=options.errors,
+                      hangs=options.hangs, hang_time=options.hang_time, etags=options.etags,
+                      changes=options.changes, port=port, seed=options.seed)
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    add_options(parser)
+    parser.add_option('--port', type='int', default=8000, help='port to listen on [default: %default]')
+    parser.add_option('--advance-every', type='float', default=0,
+                      help='seconds between changes to the feeds, 0 for never [default: %default]')
+    (options, args) = parser.parse_args()
+    server = server_from_options(options, options.port).start()
+    print(server.feeds_file(), end='')
+    try:
+        while True:
+            if options.advance_every:
+                time.sleep(options.advance_every)
+                server.advance()
+            else:
+                time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2012-2014 Roberto Alsina and others.
+
+# Permission is hereby granted, free of charge, to any
+# person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the
+# Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice
+# shall be included in all copies or substantial portions of
+# the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS
+# OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Time planetoid refreshes against the local feed server.
+
+Each round refreshes all feeds and then runs the post generation tasks
+through doit, in a scratch directory, and prints how long each phase took.
+Between rounds some feeds get new entries (see --changes), so the later
+rounds show how conditional requests and change detection pay off.
+
+Needs Python 2 (like planetoid itself), Nikola and the planetoid
+requirements; for example:
+
+    python run_benchmark.py --feeds 1000 --latency 0.2 --rounds 3 --workers 32
+"""
+
+from __future__ import print_function, unicode_literals
+from optparse import OptionParser
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from doit.cmd_base import ModuleTaskLoader
+from doit.doit_cmd import DoitMain
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import feed_server  # NOQA
+import planetoid  # NOQA
+
+
+class _Site(object):
+    """The parts of a Nikola site planetoid uses."""
+
+    def __init__(self, config):
+        self.config = config
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def run_round(plugin):
+    """Refresh the feeds and generate the posts once; return the time each phase took."""
+    timings = []
+    start = time.time()
+    plugin.init_db()
+    plugin.load_feeds()
+    plugin.prune_entries()
+    timings.append(('prepare', time.time() - start))
+
+    # Fetch every feed, no matter when planetoid would check it next
+    planetoid.Feed.update(next_check=None).execute()
+    start = time.time()
+    plugin.update_feeds()
+    timings.append(('fetch', time.time() - start))
+
+    def task_generate_posts():
+        for task in plugin.task_generate_posts():
+            # The fetch task is run above, not by doit
+            task.pop('task_dep', None)
+            yield task
+
+    start = time.time()
+    status = DoitMain(ModuleTaskLoader({'task_generate_posts': task_generate_posts})).run(['--reporter', 'zero'])
+    if status:
+        raise RuntimeError("Generating the posts failed, doit returned {0}".format(status))
+    timings.append(('generate', time.time() - start))
+    return timings
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    feed_server.add_options(parser)
+    parser.add_option('--rounds', type='int', default=3, help='number of refreshes [default: %default]')
+    parser.add_option('--workers', type='int', default=16,
+                      help='PLANETOID_FETCH_WORKERS [default: %default]')
+    # All feeds live on the same host here, so the per host limit is the workers limit by default
+    parser.add_option('--per-host', type='int', default=None,
+                      help='PLANETOID_FETCH_PER_HOST [default: same as --workers]')
+    parser.add_option('--connect-timeout', type='float', default=10,
+                      help='PLANETOID_CONNECT_TIMEOUT [default: %default]')
+    parser.add_option('--read-timeout', type='float', default=30,
+                      help='PLANETOID_READ_TIMEOUT [default: %default]')
+    parser.add_option('--parse-workers', type='int', default=None,
+                      help='PLANETOID_PARSE_WORKERS [default: number of CPUs]')
+    parser.add_option('--keep', action='store_true', default=False,
+                      help='keep the scratch directory and print its path')
+    (options, args) = parser.parse_args()
+    if sys.version_info[0] == 3:
+        parser.error("planetoid needs Python 2")
+
+    plugin = planetoid.Planetoid()
+    plugin.site = _Site({
+        'PLANETOID_FETCH_WORKERS': options.workers,
+        'PLANETOID_FETCH_PER_HOST': options.per_host or options.workers,
+        'PLANETOID_CONNECT_TIMEOUT': options.connect_timeout,
+        'PLANETOID_READ_TIMEOUT': options.read_timeout,
+        'PLANETOID_PARSE_WORKERS': options.parse_workers,
+    })
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix='planetoid-benchmark-')
+    try:
+        with feed_server.server_from_options(options) as server:
+            os.chdir(scratch)
+            with open('feeds', 'wb') as fd:
+                fd.write(server.feeds_file().encode('utf-8'))
+            print("{0:>5} {1:>9} {2:>9} {3:>9} {4:>8} {5:>6} {6:>6} {7:>10} {8:>10}".format(
+                'round', 'prepare', 'fetch', 'generate', 'requests', '304', 'errors', 'downloaded', 'database'))
+            for round_number in range(options.rounds):
+                if round_number:
+                    server.advance()
+                server.reset_stats()
+                timings = dict(run_round(plugin))
+                print("{0:>5} {1:>8.2f}s {2:>8.2f}s {3:>8.2f}s {4:>8} {5:>6} {6:>6} {7:>8}KB {8:>8}KB".format(
+                    round_number + 1, timings['prepare'], timings['fetch'], timings['generate'],
+                    server.stats['requests'], server.stats['not_modified'], server.stats['errors'],
+                    server.stats['bytes'] // 1024, os.path.getsize('peewee.db') // 1024))
+            print("{0} post files, {1}KB".format(len(os.listdir('posts')), _dir_size('posts') // 1024))
+    finally:
+        os.chdir(cwd)
+        if options.keep:
+            print(scratch)
+        else:
+            shutil.rmtree(scratch)
+
+
+if __name__ == '__main__':
+    # doit reads the source of the task creators, which it can't find from the
+    # scratch directory if this script was started by a relative path; the
+    # module imported from the absolute path added to sys.path above has no
+    # such problem.
+    import run_benchmark
+    run_benchmark.main()
@@ -25,19 +25,39 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 from __future__ import print_function, unicode_literals
+import calendar
 import codecs
+from collections import OrderedDict
 import datetime
+from email.utils import formatdate, parsedate
 import hashlib
+import multiprocessing
 from optparse import OptionParser
 import os
+import re
 import sys
+import threading
+import time
+from xml.sax.saxutils import escape
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse  # NOQA
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # NOQA
 
-from doit.tools import timeout
 from nikola.plugin_categories import Command, Task
 from nikola.utils import config_changed, req_missing, get_logger, STDERR_HANDLER
 
 LOGGER = get_logger('planetoid', STDERR_HANDLER)
 
+# Stored as last_modified when the server sent no Last-Modified header
+NEVER = datetime.datetime(1970, 1, 1)
+
 try:
     import feedparser
 except ImportError:
@@ -45,25 +65,293 @@ except ImportError:
 
 try:
     import peewee
+    from playhouse.migrate import SqliteMigrator, migrate
 except ImportError:
     peewee = None
 
+try:
+    import requests
+except ImportError:
+    requests = None  # NOQA
+
 
 if peewee is not None:
     class Feed(peewee.Model):
-        name = peewee.CharField()
+        name = peewee.CharField(index=True)
         url = peewee.CharField(max_length=200)
         last_status = peewee.CharField(null=True)
         etag = peewee.CharField(max_length=200)
         last_modified = peewee.DateTimeField()
+        # Scheduling, see refresh_interval
+        last_checked = peewee.DateTimeField(null=True)
+        next_check = peewee.DateTimeField(null=True, index=True)
+        update_interval = peewee.FloatField(null=True)
+        failures = peewee.IntegerField(default=0)
 
     class Entry(peewee.Model):
-        date = peewee.DateTimeField()
+        date = peewee.DateTimeField(index=True)
         feed = peewee.ForeignKeyField(Feed)
         content = peewee.TextField()
         link = peewee.CharField(max_length=200)
         title = peewee.CharField(max_length=200)
         guid = peewee.CharField(max_length=200)
+        # Hash of everything written to the post files, see entry_hash
+        content_hash = peewee.CharField(max_length=32, null=True)
+        # Shared by copies of the same article, see entry_fingerprint
+        fingerprint = peewee.CharField(max_length=32, null=True, index=True)
+
+        class Meta:
+            # Different feeds may carry the same entries, e.g. category feeds of a blog
+            indexes = ((('feed', 'guid'), True),)
+
+# Extension of the post files for each PLANETOID_OUTPUT_FORMAT
+POST_EXTENSIONS = {'rest': '.txt', 'html': '.html'}
+
+# Rows per INSERT statement, well below SQLite's limit of 999 variables
+UPSERT_BATCH_SIZE = 100
+
+# Compact the database after pruning only once this fraction of it is unused
+VACUUM_FREE_FRACTION = 0.25
+
+
+def post_id(entry):
+    """Return the name of the post files of an entry."""
+    h = hashlib.md5()
+    h.update(entry.feed.name.encode('utf8'))
+    h.update(entry.guid)
+    return h.hexdigest()
+
+
+def entry_hash(title, date, link, content):
+    """Hash the parts of an entry which end up in its post files."""
+    h = hashlib.md5()
+    for value in (title, date.strftime('%Y/%m/%d %H:%M'), link, content):
+        h.update(value.encode('utf8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+_TAG_RE = re.compile(r'<[^>]*>')
+_NON_WORD_RE = re.compile(r'[\W_]+', re.UNICODE)
+# Placeholders used for a missing title or content, and common ones of feeds
+_PLACEHOLDER_RE = re.compile(r'\b(?:sin título|sin contenido|untitled|no title)\b', re.UNICODE)
+# Fewer words than this say too little to tell two entries apart
+FINGERPRINT_MIN_WORDS = 3
+
+
+def entry_fingerprint(title, content):
+    """Hash the text of an entry, ignoring markup, case and punctuation.
+
+    title is the entry's own title, without the feed name.  Cross-posts of
+    an article in several feeds share their fingerprint.  Entries with
+    little text besides placeholders, like untitled link posts, get an
+    empty fingerprint, so they are never taken for copies of each other.
+    """
+    text = _PLACEHOLDER_RE.sub(' ', _TAG_RE.sub(' ', '%s %s' % (title, content)).lower())
+    text = _NON_WORD_RE.sub(' ', text).strip()
+    if len(text.split()) < FINGERPRINT_MIN_WORDS:
+        return ''
+    return hashlib.md5(text.encode('utf8')).hexdigest()
+
+
+def refresh_interval(update_interval, quiet_for, failures, default, minimum, maximum):
+    """Return how many minutes to wait before fetching a feed again.
+
+    update_interval is the typical time between the feed's entries and
+    quiet_for the time since it last changed, both in minutes and None if
+    unknown.  Feeds are checked twice per update interval, so active feeds
+    are fetched often, and feeds which have been quiet for longer than that
+    are backed off.  Failing feeds are backed off exponentially.  The
+    result is kept between minimum and maximum.
+    """
+    if failures:
+        interval = minimum * 2 ** failures
+    elif update_interval is None and quiet_for is None:
+        interval = default
+    else:
+        interval = max(update_interval or 0, quiet_for or 0) / 2
+    return max(minimum, min(maximum, interval))
+
+
+def newest_rows(rows, other_dates, limit):
+    """Return the rows whose date is among the limit newest, counting other_dates too."""
+    if limit <= 0:
+        return []
+    dates = sorted([row['date'] for row in rows] + list(other_dates), reverse=True)
+    if len(dates) <= limit:
+        return rows
+    return [row for row in rows if row['date'] >= dates[limit - 1]]
+
+
+def add_missing_columns(model):
+    """Add the columns declared on model which its (older) table lacks."""
+    db = model._meta.database
+    existing = [column.name for column in db.get_columns(model._meta.db_table)]
+    migrator = SqliteMigrator(db)
+    for field in model._meta.sorted_fields:
+        if field.db_column not in existing:
+            migrate(migrator.add_column(model._meta.db_table, field.db_column, field))
+
+
+def add_missing_indexes(model):
+    """Create the indexes declared on model which its (older) table lacks."""
+    db = model._meta.database
+    existing = set(tuple(index.columns) for index in db.get_indexes(model._meta.db_table))
+    for fields, unique in model._index_data():
+        fields = [field if isinstance(field, peewee.Field) else model._meta.fields[field] for field in fields]
+        if tuple(field.db_column for field in fields) not in existing:
+            db.create_index(model, fields, unique)
+
+
+def fetch_feed(url, etag=None, modified=None, timeouts=(10, 30)):
+    """Download a feed.
+
+    timeouts is a (connect, read) pair of seconds.  Returns a dict with the
+    HTTP status, the (lowercased) response headers, the raw content, an
+    error message if the download failed, and the time it took.
+    """
+    result = {'url': url, 'status': None, 'headers': {}, 'content': b'', 'error': None}
+    start = time.time()
+    try:
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified and modified != NEVER:
+            headers['If-Modified-Since'] = formatdate(calendar.timegm(modified.timetuple()), usegmt=True)
+        response = requests.get(url, headers=headers, timeout=timeouts)
+        result['status'] = response.status_code
+        result['headers'] = dict((k.lower(), v) for k, v in response.headers.items())
+        result['headers'].setdefault('content-location', response.url)
+        result['content'] = response.content
+    except requests.RequestException as e:
+        result['error'] = str(e)
+    except Exception as e:
+        # Anything else is a bug or a very broken feed, but it must not stop the other feeds
+        LOGGER.error("Could not fetch {0}: {1!r}".format(url, e))
+        result['error'] = repr(e)
+    result['elapsed'] = time.time() - start
+    return result
+
+
+def fetch_feeds(jobs, workers=16, per_host=2, timeouts=(10, 30), callback=None):
+    """Download feeds concurrently.
+
+    jobs is a list of (url, etag, modified) tuples.  At most workers feeds
+    are downloaded at the same time, and at most per_host from the same
+    host.  If given, callback(i, result) is called (from a worker thread)
+    as soon as job i is done; if it raises, the job counts as failed.
+    Returns the results of fetch_feed, in the order of jobs.
+    """
+    results = [None] * len(jobs)
+    by_host = OrderedDict()
+    for i, job in enumerate(jobs):
+        by_host.setdefault(urlparse(job[0]).netloc, []).append(i)
+    # Interleave the hosts, so the workers don't all wait on the limit of one host
+    pending = queue.Queue()
+    groups = list(by_host.values())
+    for rank in range(max([len(group) for group in groups] or [0])):
+        for group in groups:
+            if rank < len(group):
+                pending.put(group[rank])
+    limits = dict((host, threading.BoundedSemaphore(per_host)) for host in by_host)
+
+    def worker():
+        while True:
+            try:
+                i = pending.get_nowait()
+            except queue.Empty:
+                return
+            url, etag, modified = jobs[i]
+            with limits[urlparse(url).netloc]:
+                results[i] = fetch_feed(url, etag, modified, timeouts)
+            if callback is not None:
+                try:
+                    callback(i, results[i])
+                except Exception as e:
+                    LOGGER.error("Could not process {0}: {1!r}".format(url, e))
+                    results[i]['error'] = repr(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(min(workers, len(jobs)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def needs_parsing(result):
+    """Tell whether a fetch_feed result has entries to parse."""
+    return not result['error'] and result['status'] != 304 and result['status'] <= 400
+
+
+def fork_pool(workers):
+    """Return a pool of forked worker processes, or None if that is not possible.
+
+    The workers must be forked: the plugin module is loaded by yapsy, so
+    spawned workers could not import it to unpickle the functions to run.
+    """
+    if workers <= 1 or not hasattr(os, 'fork'):
+        return None
+    try:
+        try:
+            return multiprocessing.get_context('fork').Pool(workers)
+        except AttributeError:  # Python 2 always forks
+            return multiprocessing.Pool(workers)
+    except (AssertionError, OSError):  # e.g. when running in a daemonic process
+        return None
+
+
+def parse_feed(name, result):
+    """Parse a feed downloaded by fetch_feed.
+
+    This is CPU bound, so it runs in a worker process and returns plain
+    data: a dict with the feed title, the rows to store for its entries
+    (without the feed), and the number of entries skipped for having no
+    date.
+    """
+    parsed = feedparser.parse(result['content'], response_headers=result['headers'])
+    rows = []
+    undated = 0
+    dates = []
+    for entry_data in parsed.entries:
+        date = entry_data.get('published_parsed', None)
+        if date is None:
+            date = entry_data.get('updated_parsed', None)
+        if date is None:
+            undated += 1
+            continue
+        date = datetime.datetime(*(date[:6]))
+        dates.append(date)
+        entry_title = entry_data.get('title', 'Sin título')
+        title = "%s: %s" % (name, entry_title)
+        content = entry_data.get('content', None)
+        if content:
+            content = content[0].value
+        if not content:
+            content = entry_data.get('description', None)
+        if not content:
+            content = entry_data.get('summary', 'Sin contenido')
+        link = entry_data.get('link', '')
+        rows.append(dict(
+            date=date,
+            title=title,
+            content=content,
+            guid=str(entry_data.get('guid', link)),
+            link=link,
+            content_hash=entry_hash(title, date, link, content),
+            fingerprint=entry_fingerprint(entry_title, content),
+        ))
+    # The median time between the newest entries, in minutes
+    dates = sorted(dates, reverse=True)[:10]
+    gaps = sorted((newer - older).total_seconds() / 60 for newer, older in zip(dates, dates[1:]))
+    return {
+        'title': parsed.feed.get('title'),
+        'rows': rows,
+        'undated': undated,
+        'newest': dates[0] if dates else None,
+        'update_interval': gaps[len(gaps) // 2] if gaps else None,
+    }
 
 
 class Planetoid(Command, Task):
@@ -74,13 +362,36 @@ class Planetoid(Command, Task):
         # setup database
         Feed.create_table(fail_silently=True)
         Entry.create_table(fail_silently=True)
+        # Older versions stored a made up ETag, which was sent back to the server
+        Feed.update(etag='').where(Feed.etag == 'foo').execute()
+        # Older versions lacked some columns
+        db = Entry._meta.database
+        add_missing_columns(Feed)
+        add_missing_columns(Entry)
+        # Older versions made guid unique across all feeds
+        for index in db.get_indexes('entry'):
+            if index.unique and index.columns == ['guid']:
+                db.execute_sql('DROP INDEX "%s"' % index.name)
+        # Older versions created no indexes; (feed, guid) must be unique before it can get one.
+        # The duplicates dropped here have the same post files as the entry which is kept.
+        if not any(index.unique and index.columns == ['feed_id', 'guid'] for index in db.get_indexes('entry')):
+            db.execute_sql('DELETE FROM entry WHERE id NOT IN (SELECT MAX(id) FROM entry GROUP BY feed_id, guid)')
+        add_missing_indexes(Feed)
+        add_missing_indexes(Entry)
+        # Entries stored by older versions have no fingerprint yet
+        with db.atomic():
+            for entry in Entry.select(Entry, Feed).join(Feed).where(Entry.fingerprint >> None):
+                prefix = '%s: ' % entry.feed.name
+                title = entry.title[len(prefix):] if entry.title.startswith(prefix) else entry.title
+                Entry.update(fingerprint=entry_fingerprint(title, entry.content)).where(Entry.id == entry.id).execute()
 
     def gen_tasks(self):
-        if peewee is None or sys.version_info[0] == 3:
+        if peewee is None or requests is None or sys.version_info[0] == 3:
             if sys.version_info[0] == 3:
                 message = 'Peewee, a requirement of the "planetoid" command, is currently incompatible with Python 3.'
             else:
-                req_missing('peewee', 'use the "planetoid" command')
+                req_missing([name for name, module in (('peewee', peewee), ('requests', requests)) if module is None],
+                            'use the "planetoid" command')
                 message = ''
             yield {
                 'basename': self.name,
@@ -91,9 +402,12 @@ class Planetoid(Command, Task):
         else:
             self.init_db()
             self.load_feeds()
+            expired = self.expired_entries()
             for task in self.task_update_feeds():
                 yield task
-            for task in self.task_generate_posts():
+            for task in self.task_prune_entries(expired):
+                yield task
+            for task in self.task_generate_posts(expired):
                 yield task
             yield {
                 'basename': self.name,
@@ -102,6 +416,7 @@ class Planetoid(Command, Task):
                 'file_dep': ['feeds'],
                 'task_dep': [
                     self.name + "_fetch_feed",
+                    self.name + "_prune_entries",
                     self.name + "_generate_posts",
                 ]
             }
@@ -130,8 +445,8 @@ class Planetoid(Command, Task):
             f = Feed.create(
                 name=name,
                 url=url,
-                etag='foo',
-                last_modified=datetime.datetime(1970, 1, 1),
+                etag='',
+                last_modified=NEVER,
             )
             f.save()
 
@@ -139,146 +454,317 @@ class Planetoid(Command, Task):
             feed.url = url
             feed.save()
 
+        known = dict((f.name, f) for f in Feed.select())
         for feed, name in feeds:
-            f = Feed.select().where(Feed.name == name)
-            if not list(f):
+            if name not in known:
                 add_feed(name, feed)
-            elif list(f)[0].url != feed:
-                update_feed_url(list(f)[0], feed)
+            elif known[name].url != feed:
+                update_feed_url(known[name], feed)
+
+    def retention_limits(self):
+        """Return the oldest date to keep (in UTC, like entry dates) and the maximum entries per feed and overall.
+
+        Each of them is None if there is no such limit.
+        """
+        max_age = self.site.config.get('PLANETOID_MAX_AGE', None)
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=max_age) if max_age is not None else None
+        return (cutoff,
+                self.site.config.get('PLANETOID_MAX_ENTRIES_PER_FEED', None),
+                self.site.config.get('PLANETOID_MAX_ENTRIES', None))
+
+    def retained_rows(self, feed, rows):
+        """Drop the rows of a feed which would be beyond the retention limits once stored.
+
+        Otherwise they would be stored again on every fetch, only to be
+        pruned again afterwards.
+        """
+        cutoff, max_per_feed, max_entries = self.retention_limits()
+        if cutoff is not None:
+            rows = [row for row in rows if row['date'] >= cutoff]
+        if max_per_feed is None and max_entries is None:
+            return rows
+        # The stored entries of the feed which these rows don't replace
+        guids = set(row['guid'] for row in rows)
+        query = Entry.select(Entry.date, Entry.guid).where(Entry.feed == feed)
+        others = [entry.date for entry in query if entry.guid not in guids]
+        if max_per_feed is not None:
+            rows = newest_rows(rows, others, max_per_feed)
+        if max_entries is not None:
+            query = Entry.select(Entry.date).where(Entry.feed != feed).order_by(Entry.date.desc()).limit(max_entries)
+            rows = newest_rows(rows, others + [entry.date for entry in query], max_entries)
+        return rows
+
+    def expired_entries(self):
+        """Return the ids of the entries beyond the retention limits."""
+        cutoff, max_per_feed, max_entries = self.retention_limits()
+        expired = set()
+        if cutoff is not None:
+            expired.update(entry.id for entry in Entry.select(Entry.id).where(Entry.date < cutoff))
+        if max_per_feed is not None:
+            for feed in Feed.select():
+                query = Entry.select(Entry.id).where(Entry.feed == feed).order_by(Entry.date.desc()).offset(max_per_feed)
+                expired.update(entry.id for entry in query)
+        if max_entries is not None:
+            query = Entry.select(Entry.id).order_by(Entry.date.desc()).offset(max_entries)
+            expired.update(entry.id for entry in query)
+        return sorted(expired)
+
+    def prune_entries(self, expired=None):
+        """Delete the expired entries and their posts, and compact the database if that freed enough space.
+
+        expired is a list of entry ids, by default those of expired_entries().
+        """
+        if expired is None:
+            expired = self.expired_entries()
+        if not expired:
+            return
+        files = 0
+        file_bytes = 0
+        db = Entry._meta.database
+        with db.atomic():
+            for i in range(0, len(expired), UPSERT_BATCH_SIZE):
+                batch = expired[i:i + UPSERT_BATCH_SIZE]
+                for entry in Entry.select(Entry.guid, Feed.name).join(Feed).where(Entry.id << batch):
+                    for extension in ['.meta'] + list(POST_EXTENSIONS.values()):
+                        path = os.path.join('posts', post_id(entry) + extension)
+                        if os.path.isfile(path):
+                            file_bytes += os.path.getsize(path)
+                            files += 1
+                            os.unlink(path)
+                Entry.delete().where(Entry.id << batch).execute()
+        LOGGER.info("Pruned {0} entries: removed {1} post files ({2} KiB)".format(len(expired), files, file_bytes // 1024))
+        # VACUUM rewrites the whole database, so only do it when there is a fair amount to reclaim
+        db_bytes = os.path.getsize(db.database)
+        free_bytes = (db.execute_sql('PRAGMA freelist_count').fetchone()[0] *
+                      db.execute_sql('PRAGMA page_size').fetchone()[0])
+        if free_bytes >= VACUUM_FREE_FRACTION * db_bytes:
+            db.execute_sql('VACUUM')
+            LOGGER.info("Database shrank by {0} KiB".format((db_bytes - os.path.getsize(db.database)) // 1024))
+
+    def due_feeds(self):
+        """Return a query for the feeds which should be fetched now."""
+        return Feed.select().where((Feed.next_check >> None) | (Feed.next_check <= datetime.datetime.now()))
+
+    def update_feeds(self):
+        """Download the due feeds concurrently, parse them in worker processes, then add their entries to the database."""
+        feeds = list(self.due_feeds())
+        LOGGER.info("{0} of {1} feeds are due".format(len(feeds), Feed.select().count()))
+        # Parsing starts as soon as a feed is downloaded, while the others are still downloading
+        workers = self.site.config.get('PLANETOID_PARSE_WORKERS', None) or multiprocessing.cpu_count()
+        pool = fork_pool(workers)
+        parsing = {}
+
+        def parse_later(i, result):
+            if pool is not None and needs_parsing(result):
+                parsing[i] = pool.apply_async(parse_feed, (feeds[i].name, result))
+
+        start = time.time()
+        try:
+            results = fetch_feeds(
+                [(feed.url, feed.etag, feed.last_modified) for feed in feeds],
+                workers=self.site.config.get('PLANETOID_FETCH_WORKERS', 16),
+                per_host=self.site.config.get('PLANETOID_FETCH_PER_HOST', 2),
+                timeouts=(self.site.config.get('PLANETOID_CONNECT_TIMEOUT', 10),
+                          self.site.config.get('PLANETOID_READ_TIMEOUT', 30)),
+                callback=parse_later,
+            )
+            LOGGER.info("Fetched {0} feeds in {1:.1f}s".format(len(feeds), time.time() - start))
+            for result in sorted(results, key=lambda result: -result['elapsed']):
+                LOGGER.info("{0:7.2f}s  {1}  {2}".format(result['elapsed'], result['error'] or result['status'], result['url']))
+            not_modified = len([result for result in results if result['status'] == 304])
+            LOGGER.info("{0} of {1} feeds not modified ({2:.0f}% cache hits)".format(
+                not_modified, len(feeds), 100.0 * not_modified / len(feeds) if feeds else 0))
+            for i, (feed, result) in enumerate(zip(feeds, results)):
+                failures = feed.failures
+                try:
+                    if i in parsing:
+                        data = parsing[i].get()
+                    elif needs_parsing(result):
+                        data = parse_feed(feed.name, result)
+                    else:
+                        data = None
+                    self.schedule_feed(feed, result, data)
+                    self.update_feed(feed, result, data)
+                except Exception as e:
+                    # One broken feed must not keep the others from being stored
+                    LOGGER.error("Could not update {0}: {1!r}".format(feed.url, e))
+                    result['error'] = repr(e)
+                    feed.failures = failures
+                    self.schedule_feed(feed, result, None)
+            # Feeds which were not stored with their entries only need their schedule saved
+            schedule_fields = [Feed.last_checked, Feed.next_check, Feed.update_interval, Feed.failures]
+            with Feed._meta.database.atomic():
+                for feed, result in zip(feeds, results):
+                    if result['error'] or result['status'] == 304:
+                        feed.save(only=schedule_fields)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        LOGGER.info("Updated {0} feeds in {1:.1f}s".format(len(feeds), time.time() - start))
+
+    def schedule_feed(self, feed, result, data):
+        """Decide when to fetch a feed next, from what its last fetch returned."""
+        now = datetime.datetime.now()
+        # Entry dates and Last-Modified are in UTC, next_check is local like in due_feeds
+        utcnow = datetime.datetime.utcnow()
+        quiet_for = None
+        if result['error'] or result['status'] > 400:
+            feed.failures += 1
+        else:
+            feed.failures = 0
+            if data is not None:
+                if data['update_interval'] is not None:
+                    feed.update_interval = data['update_interval']
+                if data['newest'] is not None:
+                    quiet_for = max(0, (utcnow - data['newest']).total_seconds() / 60)
+            elif result['status'] == 304 and feed.last_modified != NEVER:
+                quiet_for = max(0, (utcnow - feed.last_modified).total_seconds() / 60)
+        interval = refresh_interval(
+            feed.update_interval, quiet_for, feed.failures,
+            self.site.config.get('PLANETOID_REFRESH', 60),
+            self.site.config.get('PLANETOID_MIN_REFRESH', 15),
+            self.site.config.get('PLANETOID_MAX_REFRESH', 24 * 60))
+        feed.last_checked = now
+        feed.next_check = now + datetime.timedelta(minutes=interval)
+
+    def update_feed(self, feed, result, data):
+        """Store a downloaded feed and the entries parse_feed found in it."""
+        if result['error']:
+            LOGGER.warn("Could not fetch {0}: {1}".format(feed.url, result['error']))
+            return
+        if result['status'] == 304:
+            # Nothing changed since the last fetch, so there is nothing to parse or store
+            return
+        feed.last_status = str(result['status'])
+        # Remember the validators of this response, to make the next fetch conditional
+        feed.etag = result['headers'].get('etag', '')
+        modified = parsedate(result['headers'].get('last-modified', ''))
+        feed.last_modified = datetime.datetime(*modified[:6]) if modified else NEVER
+        # No point in adding items from missing feeds
+        if data is None:
+            feed.save()
+            return
+        LOGGER.info(data['title'] or feed.url)
+        if data['undated']:
+            LOGGER.error("{0}: can't parse the date of {1} entries".format(feed.url, data['undated']))
+        rows = self.retained_rows(feed, data['rows'])
+        for row in rows:
+            row['feed'] = feed.id
+        with Entry._meta.database.atomic():
+            feed.save()
+            # Keep the ids of known entries, REPLACE would assign new ones
+            ids = {}
+            guids = [row['guid'] for row in rows]
+            for i in range(0, len(guids), UPSERT_BATCH_SIZE):
+                query = Entry.select(Entry.id, Entry.guid).where(
+                    (Entry.feed == feed) & (Entry.guid << guids[i:i + UPSERT_BATCH_SIZE]))
+                ids.update((entry.guid, entry.id) for entry in query)
+            for row in rows:
+                row['id'] = ids.get(row['guid'])
+            for i in range(0, len(rows), UPSERT_BATCH_SIZE):
+                Entry.insert_many(rows[i:i + UPSERT_BATCH_SIZE]).upsert().execute()
+        LOGGER.info("{0}: {1} entries".format(feed.name, len(rows)))
 
     def task_update_feeds(self):
         """Download feed contents, add entries to the database."""
-        def update_feed(feed):
-            modified = feed.last_modified.timetuple()
-            etag = feed.etag
-            try:
-                parsed = feedparser.parse(
-                    feed.url,
-                    etag=etag,
-                    modified=modified
-                )
-                feed.last_status = str(parsed.status)
-            except:  # Probably a timeout
-                # TODO: log failure
-                return
-            if parsed.feed.get('title'):
-                LOGGER.info(parsed.feed.title)
-            else:
-                LOGGER.info(feed.url)
-            feed.etag = parsed.get('etag', 'foo')
-            modified = tuple(parsed.get('date_parsed', (1970, 1, 1)))[:6]
-            LOGGER.info("==========>", modified)
-            modified = datetime.datetime(*modified)
-            feed.last_modified = modified
-            feed.save()
-            # No point in adding items from missinfg feeds
-            if parsed.status > 400:
-                # TODO log failure
-                return
-            for entry_data in parsed.entries:
-                LOGGER.info("=========================================")
-                date = entry_data.get('published_parsed', None)
-                if date is None:
-                    date = entry_data.get('updated_parsed', None)
-                if date is None:
-                    LOGGER.error("Can't parse date from:\n", entry_data)
-                    return False
-                LOGGER.info("DATE:===>", date)
-                date = datetime.datetime(*(date[:6]))
-                title = "%s: %s" % (feed.name, entry_data.get('title', 'Sin título'))
-                content = entry_data.get('content', None)
-                if content:
-                    content = content[0].value
-                if not content:
-                    content = entry_data.get('description', None)
-                if not content:
-                    content = entry_data.get('summary', 'Sin contenido')
-                guid = str(entry_data.get('guid', entry_data.link))
-                link = entry_data.link
-                LOGGER.info(repr([date, title]))
-                e = list(Entry.select().where(Entry.guid == guid))
-                LOGGER.info(
-                    repr(dict(
-                        date=date,
-                        title=title,
-                        content=content,
-                        guid=guid,
-                        feed=feed,
-                        link=link,
-                    ))
-                )
-                if not e:
-                    entry = Entry.create(
-                        date=date,
-                        title=title,
-                        content=content,
-                        guid=guid,
-                        feed=feed,
-                        link=link,
-                    )
-                else:
-                    entry = e[0]
-                    entry.date = date
-                    entry.title = title
-                    entry.content = content
-                    entry.link = link
-                entry.save()
-        flag = False
-        for feed in Feed.select():
-            flag = True
-            task = {
-                'basename': self.name + "_fetch_feed",
-                'name': str(feed.url),
-                'actions': [(update_feed, (feed, ))],
-                'uptodate': [timeout(datetime.timedelta(minutes=self.site.config.get('PLANETOID_REFRESH', 60)))],
-            }
-            yield task
-        if not flag:
-            yield {
-                'basename': self.name + "_fetch_feed",
-                'name': '',
-                'actions': [],
-            }
+        yield {
+            'basename': self.name + "_fetch_feed",
+            'name': '',
+            'actions': [(self.update_feeds, ())],
+            # Every feed has its own schedule, see schedule_feed
+            'uptodate': [self.due_feeds().count() == 0],
+        }
+
+    def task_prune_entries(self, expired):
+        """Delete the given expired entries, after the feeds were updated."""
+        yield {
+            'basename': self.name + "_prune_entries",
+            'name': '',
+            'actions': [(self.prune_entries, (expired,))],
+            'uptodate': [not expired],
+            'task_dep': [self.name + "_fetch_feed"],
+        }
 
-    def task_generate_posts(self):
-        """Generate post files for the blog entries."""
-        def gen_id(entry):
-            h = hashlib.md5()
-            h.update(entry.feed.name.encode('utf8'))
-            h.update(entry.guid)
-            return h.hexdigest()
+    def task_generate_posts(self, expired=()):
+        """Generate post files for the blog entries, except the expired ones."""
+        output_format = self.site.config.get('PLANETOID_OUTPUT_FORMAT', 'rest')
+        extension = POST_EXTENSIONS[output_format]
 
-        def generate_post(entry):
-            unique_id = gen_id(entry)
+        def generate_post(entry, sources, duplicates):
+            unique_id = post_id(entry)
             meta_path = os.path.join('posts', unique_id + '.meta')
-            post_path = os.path.join('posts', unique_id + '.txt')
+            post_path = os.path.join('posts', unique_id + extension)
             with codecs.open(meta_path, 'wb+', 'utf8') as fd:
                 fd.write('%s\n' % entry.title.replace('\n', ' '))
                 fd.write('%s\n' % unique_id)
                 fd.write('%s\n' % entry.date.strftime('%Y/%m/%d %H:%M'))
                 fd.write('\n')
                 fd.write('%s\n' % entry.link)
+            content = entry.content
+            if not content:
+                content = 'Sin contenido'
+            if sources:
+                content += '\n<p class="planetoid-sources">%s</p>' % ', '.join(
+                    '<a href="%s">%s</a>' % (escape(link, {'"': '&quot;'}), escape(name)) for name, link in sources)
             with codecs.open(post_path, 'wb+', 'utf8') as fd:
-                fd.write('.. raw:: html\n\n')
-                content = entry.content
-                if not content:
-                    content = 'Sin contenido'
-                for line in content.splitlines():
-                    fd.write('    %s\n' % line)
+                if output_format == 'html':
+                    # Nikola's html compiler copies this as is, no need to go through docutils
+                    fd.write(content)
+                    fd.write('\n')
+                else:
+                    fd.write('.. raw:: html\n\n')
+                    for line in content.splitlines():
+                        fd.write('    %s\n' % line)
+            # Don't leave a post in the other format behind, Nikola would find both
+            for other in POST_EXTENSIONS.values():
+                other_path = os.path.join('posts', unique_id + other)
+                if other != extension and os.path.isfile(other_path):
+                    os.unlink(other_path)
+            # The other copies may have had posts before this one showed up
+            for duplicate_id in duplicates:
+                for path_extension in ['.meta'] + list(POST_EXTENSIONS.values()):
+                    path = os.path.join('posts', duplicate_id + path_extension)
+                    if os.path.isfile(path):
+                        os.unlink(path)
 
         if not os.path.isdir('posts'):
             os.mkdir('posts')
+        entries = Entry.select(Entry, Feed).join(Feed).order_by(Entry.date.desc())
+        window = self.site.config.get('PLANETOID_PUBLISH_WINDOW', None)
+        if window is not None:
+            # Entry dates are in UTC
+            entries = entries.where(Entry.date >= datetime.datetime.utcnow() - datetime.timedelta(days=window))
+        # Copies of the same article get a single post, made from the oldest copy
+        copies = OrderedDict()
+        expired = set(expired)
+        for entry in entries:
+            if entry.id in expired:
+                # Deleted by the prune task before the posts are generated
+                continue
+            copies.setdefault(entry.fingerprint or entry.id, []).append(entry)
         flag = False
-        for entry in Entry.select().order_by(Entry.date.desc()):
+        for group in copies.values():
             flag = True
-            entry_id = gen_id(entry)
+            group.sort(key=lambda entry: (entry.date, entry.id))
+            entry = group[0]
+            duplicates = [post_id(duplicate) for duplicate in group[1:]]
+            sources = [(copy.feed.name, copy.link) for copy in group] if len(group) > 1 else []
+            entry_id = post_id(entry)
+            # Entries stored by older versions have no hash yet
+            content_hash = entry.content_hash or entry_hash(entry.title, entry.date, entry.link, entry.content)
+            uptodate = {1: content_hash}
+            if output_format != 'rest':
+                uptodate[2] = output_format
+            if sources:
+                uptodate[3] = sources
             yield {
                 'basename': self.name + "_generate_posts",
-                'targets': [os.path.join('posts', entry_id + '.meta'), os.path.join('posts', entry_id + '.txt')],
+                'targets': [os.path.join('posts', entry_id + '.meta'), os.path.join('posts', entry_id + extension)],
                 'name': entry_id,
-                'actions': [(generate_post, (entry,))],
-                'uptodate': [config_changed({1: entry})],
-                'task_dep': [self.name + "_fetch_feed"],
+                'actions': [(generate_post, (entry, sources, duplicates))],
+                'uptodate': [config_changed(uptodate)],
+                'task_dep': [self.name + "_fetch_feed", self.name + "_prune_entries"],
             }
         if not flag:
             yield {
@@ -25,6 +25,8 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 from __future__ import unicode_literals, print_function
+import datetime
+import hashlib
 import os
 import io
 import json
@@ -37,6 +39,21 @@ except ImportError:
 from nikola import utils
 from nikola.plugin_categories import Task
 
+LOGGER = utils.get_logger('recent_posts_json', utils.STDERR_HANDLER)
+
+
+def _dumps(data):
+    """Serialize to compact JSON bytes; equal data gives identical bytes."""
+    return json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def _post_tags(post, lang):
+    """Return the tags of a post in a language."""
+    if hasattr(post, "tags_for_language"):
+        return post.tags_for_language(lang)
+    # Older Nikola versions only know the tags of the current language
+    return post.tags
+
 
 class RecentPostsJon(Task):
     """Generate JSON with recent posts."""
@@ -45,6 +62,12 @@ class RecentPostsJon(Task):
 
     def set_site(self, site):
         site.register_path_handler("recent_posts_json", self.json_path)
+        site.register_path_handler("recent_posts_json_page", self.page_path)
+        site.register_path_handler("recent_posts_json_manifest", self.manifest_path)
+        site.register_path_handler("recent_posts_json_tag", self.tag_path)
+        site.register_path_handler("recent_posts_json_category", self.category_path)
+        site.register_path_handler("recent_posts_json_since", self.since_path)
+        site.register_path_handler("recent_posts_json_head", self.head_path)
         return super(RecentPostsJon, self).set_site(site)
 
     def gen_tasks(self):
@@ -59,7 +82,11 @@ class RecentPostsJon(Task):
             "base_url": self.site.config["BASE_URL"],
             "json_posts_length": self.site.config["RECENT_POSTS_JSON_LENGTH"] if "RECENT_POSTS_JSON_LENGTH" in self.site.config else self.site.config["INDEX_DISPLAY_POST_COUNT"],
             "json_descriptions": self.site.config["RECENT_POSTS_JSON_DESCRIPTION"] if "RECENT_POSTS_JSON_DESCRIPTION" in self.site.config else False,
-            "json_previewimage": self.site.conf["RECENT_POSTS_JSON_PREVIEWIMAGE"] if "RECENT_POSTS_JSON_PREVIEWIMAGE" in self.site.config else False,
+            "json_previewimage": self.site.config["RECENT_POSTS_JSON_PREVIEWIMAGE"] if "RECENT_POSTS_JSON_PREVIEWIMAGE" in self.site.config else False,
+            "json_page_size": self.site.config["RECENT_POSTS_JSON_PAGE_SIZE"] if "RECENT_POSTS_JSON_PAGE_SIZE" in self.site.config else None,
+            "json_tags": self.site.config["RECENT_POSTS_JSON_TAGS"] if "RECENT_POSTS_JSON_TAGS" in self.site.config else False,
+            "json_categories": self.site.config["RECENT_POSTS_JSON_CATEGORIES"] if "RECENT_POSTS_JSON_CATEGORIES" in self.site.config else False,
+            "json_since_days": self.site.config["RECENT_POSTS_JSON_SINCE_DAYS"] if "RECENT_POSTS_JSON_SINCE_DAYS" in self.site.config else None,
         }
         self.site.scan_posts()
         yield self.group_task()
@@ -69,9 +96,10 @@ class RecentPostsJon(Task):
             deps = []
             deps_uptodate = []
             if kw["show_untranslated_posts"]:
-                posts = self.site.posts[:kw["json_posts_length"]]
+                all_posts = self.site.posts
             else:
-                posts = [x for x in self.site.posts if x.is_translation_available(lang)][:kw["json_posts_length"]]
+                all_posts = [x for x in self.site.posts if x.is_translation_available(lang)]
+            posts = all_posts[:kw["json_posts_length"]]
             for post in posts:
                 deps += post.deps(lang)
                 deps_uptodate += post.deps_uptodate(lang)
@@ -81,27 +109,206 @@ class RecentPostsJon(Task):
                 "file_dep": deps,
                 "targets": [output_path],
                 "actions": [(self.make_json,
-                            (posts, kw["json_descriptions"], kw["json_previewimage"], output_path))],
+                            (posts, lang, kw["json_descriptions"], kw["json_previewimage"], output_path))],
                 "task_dep": ["render_posts"],
                 "clean": True,
                 "uptodate": [utils.config_changed(kw, "nikola.plugins.task.recent_pots_json")] + deps_uptodate,
             }
             yield utils.apply_filters(task, kw["filters"])
+            if kw["json_page_size"]:
+                for task in self.page_tasks(kw, lang, all_posts):
+                    yield utils.apply_filters(task, kw["filters"])
+            if kw["json_tags"] or kw["json_categories"]:
+                for task in self.classification_tasks(kw, lang, all_posts):
+                    yield utils.apply_filters(task, kw["filters"])
+            if kw["json_since_days"] and all_posts:
+                for task in self.since_tasks(kw, lang, all_posts):
+                    yield utils.apply_filters(task, kw["filters"])
+
+    def page_tasks(self, kw, lang, posts):
+        """Write all posts as pages of json_page_size posts, and a manifest listing the pages.
+
+        Pages are counted from the oldest post, so a new post only changes
+        the newest page.  Pages are named after the hash of their content,
+        so unchanged pages keep their name and bytes, and changed pages get
+        a new name; only the manifest has to be fetched again.
+        """
+        size = kw["json_page_size"]
+        pages = []
+        oldest_first = posts[::-1]
+        for start in range(0, len(oldest_first), size):
+            entries = [self.post_entry(post, lang, kw["json_descriptions"], kw["json_previewimage"])
+                       for post in oldest_first[start:start + size][::-1]]
+            data = _dumps(entries)
+            digest = hashlib.md5(data).hexdigest()
+            output_path = os.path.join(kw["output_folder"], self.site.path("recent_posts_json_page", digest, lang))
+            pages.append({"hash": digest,
+                          "loc": self.site.link("recent_posts_json_page", digest, lang),
+                          "count": len(entries),
+                          "newest": entries[0]["date"],
+                          "oldest": entries[-1]["date"]})
+            yield {
+                "basename": "recent_posts_json",
+                "name": os.path.normpath(output_path),
+                "targets": [output_path],
+                "actions": [(self.write_bytes, (data, output_path))],
+                "task_dep": ["render_posts"],
+                "clean": True,
+                "uptodate": [utils.config_changed({1: digest}, "nikola.plugins.task.recent_posts_json:page")],
+            }
+        pages.reverse()
+        manifest = {"page_size": size, "posts": len(posts), "pages": pages}
+        output_path = os.path.join(kw["output_folder"], self.site.path("recent_posts_json_manifest", None, lang))
+        yield {
+            "basename": "recent_posts_json",
+            "name": os.path.normpath(output_path),
+            "targets": [output_path],
+            "actions": [(self.write_manifest, (manifest, output_path, [page["hash"] + ".json" for page in pages]))],
+            "task_dep": ["render_posts"],
+            "clean": True,
+            "uptodate": [utils.config_changed(manifest, "nikola.plugins.task.recent_posts_json:manifest")],
+        }
+
+    def classification_tasks(self, kw, lang, posts):
+        """Write the most recent posts of every tag and category.
+
+        All lists are collected in a single pass over the timeline.  As it
+        is sorted newest first, a list is complete once it holds
+        json_posts_length posts, and later posts are skipped.  Each file is
+        only rewritten when its own posts change.
+        """
+        length = kw["json_posts_length"]
+        latest = {"tag": {}, "category": {}}
+        for post in posts:
+            names = []
+            if kw["json_tags"]:
+                names += [("tag", tag) for tag in _post_tags(post, lang)]
+            if kw["json_categories"] and post.meta("category", lang):
+                names.append(("category", post.meta("category", lang)))
+            for kind, name in names:
+                bucket = latest[kind].setdefault(name, [])
+                if len(bucket) < length:
+                    bucket.append(post)
+
+        for kind, folder, enabled in (("tag", "tags", kw["json_tags"]),
+                                      ("category", "categories", kw["json_categories"])):
+            if not enabled:
+                continue
+            outputs = []
+            slugs = {}
+            for name, bucket in sorted(latest[kind].items()):
+                # Their files would have the same name
+                slug = utils.slugify(name)
+                if slug in slugs:
+                    LOGGER.warn("The {0}s '{1}' and '{2}' have the same slug, skipping '{2}'".format(kind, slugs[slug], name))
+                    continue
+                slugs[slug] = name
+                entries = [self.post_entry(post, lang, kw["json_descriptions"], kw["json_previewimage"])
+                           for post in bucket]
+                output_path = os.path.join(kw["output_folder"],
+                                           self.site.path("recent_posts_json_" + kind, name, lang))
+                outputs.append(output_path)
+                yield {
+                    "basename": "recent_posts_json",
+                    "name": os.path.normpath(output_path),
+                    "targets": [output_path],
+                    "actions": [(self.write_bytes, (_dumps(entries), output_path))],
+                    "task_dep": ["render_posts"],
+                    "clean": True,
+                    "uptodate": [utils.config_changed({1: entries}, "nikola.plugins.task.recent_posts_json:" + kind)],
+                }
+            # Remove the files of tags and categories which are gone
+            folder = os.path.join(kw["output_folder"], *self.classification_path(folder, None, lang))
+            keep = sorted(os.path.basename(path) for path in outputs)
+            yield {
+                "basename": "recent_posts_json",
+                "name": os.path.normpath(folder),
+                "actions": [(self.remove_stale, (folder, keep))],
+                "uptodate": [utils.config_changed({1: keep}, "nikola.plugins.task.recent_posts_json:" + kind)],
+            }
+
+    def since_tasks(self, kw, lang, posts):
+        """Write the posts of the last json_since_days days, one file per day, and a head file listing the days.
 
-    def make_json(self, posts, descriptions, previewimage, output_path):
-        recent_posts = []
+        Clients remember the date of the newest post they have seen, and
+        only fetch the days since then.  The head file says since when
+        posts are covered; clients which synced before that have to start
+        over from /index.json or the pages.
+        """
+        newest = posts[0].date
+        start = newest.replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=kw["json_since_days"] - 1)
+        days = []
         for post in posts:
-            date = int(time.mktime(post.date.timetuple()) * 1000)  # JavaScript Date
-            link = post.permalink(absolute=False)
-            title = post.title()
-            entry = {"date": date,
-                     "loc": link,
-                     "title": title}
-            if descriptions:
-                entry.update({["desc"]: post.description()})
-            if previewimage:
-                entry.update({["img"]: post.previewimage()})
-            recent_posts.append(entry)
+            if post.date < start:
+                break
+            day = post.date.strftime("%Y-%m-%d")
+            if not days or days[-1][0] != day:
+                days.append((day, []))
+            days[-1][1].append(post)
+
+        listing = []
+        for day, day_posts in days:
+            entries = [self.post_entry(post, lang, kw["json_descriptions"], kw["json_previewimage"])
+                       for post in day_posts]
+            output_path = os.path.join(kw["output_folder"], self.site.path("recent_posts_json_since", day, lang))
+            listing.append({"day": day,
+                            "loc": self.site.link("recent_posts_json_since", day, lang),
+                            "count": len(entries),
+                            "latest": entries[0]["date"]})
+            yield {
+                "basename": "recent_posts_json",
+                "name": os.path.normpath(output_path),
+                "targets": [output_path],
+                "actions": [(self.write_bytes, (_dumps(entries), output_path))],
+                "task_dep": ["render_posts"],
+                "clean": True,
+                "uptodate": [utils.config_changed({1: entries}, "nikola.plugins.task.recent_posts_json:since")],
+            }
+        head = {"latest": listing[0]["latest"],
+                "covers": int(time.mktime(start.timetuple()) * 1000),  # JavaScript Date
+                "days": listing}
+        output_path = os.path.join(kw["output_folder"], self.site.path("recent_posts_json_head", None, lang))
+        yield {
+            "basename": "recent_posts_json",
+            "name": os.path.normpath(output_path),
+            "targets": [output_path],
+            "actions": [(self.write_manifest, (head, output_path, [day["day"] + ".json" for day in listing]))],
+            "task_dep": ["render_posts"],
+            "clean": True,
+            "uptodate": [utils.config_changed(head, "nikola.plugins.task.recent_posts_json:head")],
+        }
+
+    def post_entry(self, post, lang, descriptions, previewimage):
+        entry = {"date": int(time.mktime(post.date.timetuple()) * 1000),  # JavaScript Date
+                 "loc": post.permalink(lang, absolute=False),
+                 "title": post.title(lang)}
+        if descriptions:
+            entry["desc"] = post.description(lang)
+        if previewimage:
+            entry["img"] = post.meta("previewimage", lang)
+        return entry
+
+    def write_bytes(self, data, output_path):
+        utils.makedirs(os.path.dirname(output_path))
+        with io.open(output_path, "wb") as outf:
+            outf.write(data)
+
+    def write_manifest(self, manifest, output_path, listed):
+        """Write a manifest, and remove the files next to it which it does not list (any more)."""
+        self.write_bytes(_dumps(manifest), output_path)
+        self.remove_stale(os.path.dirname(output_path), listed + [os.path.basename(output_path)])
+
+    def remove_stale(self, folder, keep):
+        """Remove the JSON files in folder which are not listed in keep."""
+        if not os.path.isdir(folder):
+            return
+        keep = set(keep)
+        for name in os.listdir(folder):
+            if name.endswith(".json") and name not in keep:
+                os.unlink(os.path.join(folder, name))
+
+    def make_json(self, posts, lang, descriptions, previewimage, output_path):
+        recent_posts = [self.post_entry(post, lang, descriptions, previewimage) for post in posts]
         data = json.dumps(recent_posts, indent=2, sort_keys=True)
         with io.open(output_path, "w+", encoding="utf8") as outf:
             outf.write(data)
@@ -109,3 +316,26 @@ class RecentPostsJon(Task):
     def json_path(self, name, lang):
         return [_f for _f in [self.site.config["TRANSLATIONS"][lang],
                               os.path.splitext(self.site.config["INDEX_FILE"])[0] + ".json"] if _f]
+
+    def page_path(self, name, lang):
+        return [_f for _f in [self.site.config["TRANSLATIONS"][lang], "recent_posts", name + ".json"] if _f]
+
+    def manifest_path(self, name, lang):
+        return [_f for _f in [self.site.config["TRANSLATIONS"][lang], "recent_posts", "manifest.json"] if _f]
+
+    def since_path(self, name, lang):
+        return [_f for _f in [self.site.config["TRANSLATIONS"][lang], "recent_posts", "since", name + ".json"] if _f]
+
+    def head_path(self, name, lang):
+        return [_f for _f in [self.site.config["TRANSLATIONS"][lang], "recent_posts", "since", "head.json"] if _f]
+
+    def tag_path(self, name, lang):
+        return self.classification_path("tags", name, lang)
+
+    def category_path(self, name, lang):
+        return self.classification_path("categories", name, lang)
+
+    def classification_path(self, folder, name, lang):
+        """Path of the file of a tag or category, or of their folder if name is None."""
+        return [_f for _f in [self.site.config["TRANSLATIONS"][lang], "recent_posts", folder,
+                              utils.slugify(name) + ".json" if name else None] if _f]
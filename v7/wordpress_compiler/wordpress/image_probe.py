@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+# A WordPress compiler plugin for Nikola
+#
+# Copyright (C) 2014-2015 by Felix Fontein
+# Copyright (C) by the WordPress contributors
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Determine image dimensions from file headers, without decoding the image."""
+
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import struct
+
+from nikola.utils import makedirs
+
+_HEADER_SIZE = 32
+
+# JPEG start-of-frame markers (all SOFn except DHT, JPG and DAC)
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+# JPEG markers which are not followed by a length field
+_JPEG_STANDALONE_MARKERS = set(range(0xD0, 0xD9)) | set([0x01])
+
+
+def _probe_jpeg(f):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            continue
+        marker = f.read(1)
+        # Skip fill bytes
+        while marker == b'\xff':
+            marker = f.read(1)
+        if not marker:
+            return None
+        marker = struct.unpack('>B', marker)[0]
+        if marker in _JPEG_STANDALONE_MARKERS or marker == 0x00:
+            continue
+        if marker == 0xD9:
+            return None
+        data = f.read(2)
+        if len(data) < 2:
+            return None
+        length = struct.unpack('>H', data)[0]
+        if marker in _JPEG_SOF_MARKERS:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack('>xHH', data)
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _probe_webp(header):
+    chunk = header[12:16]
+    if chunk == b'VP8 ' and header[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', header[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and header[20:21] == b'\x2f':
+        bits = struct.unpack('<I', header[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        width = struct.unpack('<I', header[24:27] + b'\x00')[0]
+        height = struct.unpack('<I', header[27:30] + b'\x00')[0]
+        return width + 1, height + 1
+    return None
+
+
+def probe_image_size(filename):
+    """Return ``(width, height)`` of a JPEG, PNG, GIF or WebP file, or ``None``.
+
+    Only the file header is read; for JPEG files, the segments before the
+    start-of-frame marker are skipped by seeking over them.
+    """
+    with io.open(filename, 'rb') as f:
+        header = f.read(_HEADER_SIZE)
+        if len(header) < 10:
+            return None
+        if header[:8] == b'\x89PNG\r\n\x1a\n' and header[12:16] == b'IHDR':
+            return struct.unpack('>II', header[16:24])
+        if header[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack('<HH', header[6:10])
+        if header[:4] == b'RIFF' and header[8:12] == b'WEBP' and len(header) >= 30:
+            return _probe_webp(header)
+        if header[:2] == b'\xff\xd8':
+            return _probe_jpeg(f)
+    return None
+
+
+class ImageSizeCache(object):
+    """Cache of probed image sizes, keyed by path and invalidated by mtime."""
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.__data = None
+        self.__dirty = False
+
+    def __load(self):
+        if self.__data is not None:
+            return
+        self.__data = {}
+        if os.path.isfile(self.cache_file):
+            try:
+                with io.open(self.cache_file, 'rb') as f:
+                    self.__data = json.loads(f.read().decode('utf-8'))
+            except (IOError, ValueError):
+                self.__data = {}
+
+    def get_size(self, filename):
+        """Return ``(width, height)`` for the given file, or ``None`` if unknown."""
+        self.__load()
+        try:
+            mtime = os.stat(filename).st_mtime
+        except OSError:
+            return None
+        entry = self.__data.get(filename)
+        if entry is None or entry[0] != mtime:
+            try:
+                size = probe_image_size(filename)
+            except (IOError, struct.error):
+                size = None
+            entry = [mtime] + (list(size) if size else [None, None])
+            self.__data[filename] = entry
+            self.__dirty = True
+        if entry[1] is None or entry[2] is None:
+            return None
+        return entry[1], entry[2]
+
+    def save(self):
+        if not self.__dirty:
+            return
+        makedirs(os.path.dirname(self.cache_file))
+        with io.open(self.cache_file, 'wb') as f:
+            f.write(json.dumps(self.__data, sort_keys=True).encode('utf-8'))
+        self.__dirty = False
@@ -25,8 +25,15 @@ from nikola.utils import get_logger, STDERR_HANDLER
 
 _LOGGER = get_logger('wordpress_shortcode_gallery', STDERR_HANDLER)
 
+import os
 import re
 
+try:
+    from urlparse import urlparse
+    from urllib import unquote
+except ImportError:
+    from urllib.parse import urlparse, unquote  # NOQA
+
 
 def sanitize_html_class(clazz):
     # Strip out percent encoded octets
@@ -82,6 +89,46 @@ class Gallery(nikola.plugin_categories.CompilerExtension):
             h = float(max_h)
         return int(w), int(h)
 
+    def _find_local_file(self, url):
+        # Map an attachment URL to a file in one of FILES_FOLDERS or in OUTPUT_FOLDER
+        config = self._compile_wordpress.site.config
+        path = unquote(urlparse(url).path)
+        base_path = urlparse(config['BASE_URL']).path
+        if base_path and path.startswith(base_path):
+            path = '/' + path[len(base_path):]
+        path = path.lstrip('/')
+        candidates = []
+        for src, dest in config['FILES_FOLDERS'].items():
+            dest = dest.strip('/')
+            if not dest:
+                candidates.append(os.path.join(src, path))
+            elif path.startswith(dest + '/'):
+                candidates.append(os.path.join(src, path[len(dest) + 1:]))
+        candidates.append(os.path.join(config['OUTPUT_FOLDER'], path))
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                return candidate
+        return None
+
+    def _fill_missing_sizes(self, image, context):
+        # Probe image headers for files whose width/height are not in the attachment metadata
+        files_meta = image.get('files_meta')
+        if files_meta is None:
+            files_meta = image['files_meta'] = []
+        while len(files_meta) < len(image['files']):
+            files_meta.append({})
+        for url, meta in zip(image['files'], files_meta):
+            if 'width' in meta and 'height' in meta:
+                continue
+            filename = self._find_local_file(url)
+            if filename is None:
+                continue
+            size = self._image_sizes.get_size(filename)
+            if size is None:
+                continue
+            meta['width'], meta['height'] = size
+            context.add_file_dependency(filename, 'fragment')
+
     def _process_gallery_tags(self, args, content, tag, context):
         # Get gallery counter per post
         gallery_counter = context.inc_plugin_counter('wordpress_shortcode_gallery', 'counter')
@@ -104,7 +151,9 @@ class Gallery(nikola.plugin_categories.CompilerExtension):
             if attachment is None:
                 _LOGGER.error("Cannot find attachment {1} for post {0}!".format(context.get_name(), id))
                 return "(Error loading gallery)"
+            self._fill_missing_sizes(attachment, context)
             images.append(attachment)
+        self._image_sizes.save()
 
         # Empty gallery
         if len(images) == 0:
@@ -190,4 +239,6 @@ class Gallery(nikola.plugin_categories.CompilerExtension):
     def register(self, compile_wordpress, wordpress_modules):
         self._user_logged_in = False
         self._compile_wordpress = compile_wordpress
+        cache_file = os.path.join(compile_wordpress.site.config['CACHE_FOLDER'], 'wordpress_image_sizes.json')
+        self._image_sizes = wordpress_modules['image_probe'].ImageSizeCache(cache_file)
         compile_wordpress.register_shortcode('gallery', self._process_gallery_tags)
@@ -31,7 +31,7 @@ from nikola.plugin_categories import PageCompiler
 from nikola.utils import makedirs, write_metadata
 from nikola.utils import get_logger, STDERR_HANDLER
 
-from . import default_filters, php, plugin_interface, shortcodes
+from . import default_filters, image_probe, php, plugin_interface, shortcodes
 
 _LOGGER = get_logger('compile_wordpress', STDERR_HANDLER)
 
@@ -131,6 +131,7 @@ class CompileWordpress(PageCompiler):
         count = 0
         modules = {
             'default_filters': default_filters,
+            'image_probe': image_probe,
             'php': php,
             'plugin_interface': plugin_interface,
             'shortcodes': shortcodes,